@@ -1,60 +1,156 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
+from datetime import datetime
 from typing import List, Optional
 from app.schemas.schemas import ChatRequest, ChatResponse, ChatMessageResponse
 from app.services.rag_service import rag_service
 from app.models.models import Subject, ChatMessage
-from app.core.database import get_session
-from sqlmodel import Session, select
+from app.core.database import get_session, engine
+from app.config import settings
+from sqlmodel import Session, select, col
+import anyio
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+def _latest_messages(session: Session, subject_id: int, limit: int, before: Optional[datetime] = None, exclude_id: Optional[int] = None) -> List[ChatMessage]:
+    """The newest `limit` messages of a subject (older than `before`), oldest first."""
+    query = select(ChatMessage).where(ChatMessage.subject_id == subject_id)
+    if before is not None:
+        query = query.where(ChatMessage.created_at < before)
+    if exclude_id is not None:
+        query = query.where(ChatMessage.id != exclude_id)
+    # Walks the (subject_id, created_at) index backwards and stops after `limit` rows
+    messages = session.exec(query.order_by(col(ChatMessage.created_at).desc()).limit(limit)).all()
+    return list(reversed(messages))
+
+def _recent_history(session: Session, subject_id: int, current_id: int) -> List[dict]:
+    """The last few turns before the current message, for multi-turn context."""
+    if settings.CHAT_HISTORY_MESSAGES <= 0:
+        return []
+    messages = _latest_messages(session, subject_id, settings.CHAT_HISTORY_MESSAGES, exclude_id=current_id)
+    return [{"role": m.role, "content": m.content} for m in messages]
+
+# The chat routes are async so they can await the LLM; their database work runs in these
+# sync helpers on a worker thread, so a commit waiting on SQLite's write lock (held by
+# background ingestion) never blocks the event loop.
+
+def _save_user_message(subject_id: int, content: str) -> Optional[List[dict]]:
+    """Saves the user's message and returns the turns before it, or None if the subject doesn't exist."""
+    with Session(engine) as session:
+        if not session.get(Subject, subject_id):
+            return None
+        user_msg = ChatMessage(role="user", content=content, subject_id=subject_id)
+        session.add(user_msg)
+        session.commit()
+        session.refresh(user_msg)
+        # Recent turns for multi-turn context (the LLM gets them within a token budget)
+        return _recent_history(session, subject_id, user_msg.id)
+
+def _save_assistant_message(subject_id: int, content: str) -> int:
+    with Session(engine) as session:
+        assistant_msg = ChatMessage(role="assistant", content=content, subject_id=subject_id)
+        session.add(assistant_msg)
+        session.commit()
+        session.refresh(assistant_msg)
+        return assistant_msg.id
+
+def _subject_name(subject_id: int) -> Optional[str]:
+    with Session(engine) as session:
+        subject = session.get(Subject, subject_id)
+        return subject.name if subject else None
+
 @router.post("/", response_model=ChatResponse)
-def chat(request: ChatRequest, session: Session = Depends(get_session)):
-    # Verify subject exists
-    subject = session.get(Subject, request.subject_id)
-    if not subject:
+async def chat(request: ChatRequest):
+    # 1. Verify subject exists, save User Message and load the recent turns
+    history = await asyncio.to_thread(_save_user_message, request.subject_id, request.message)
+    if history is None:
         raise HTTPException(status_code=404, detail="Subject not found")
 
-    # 1. Save User Message
-    user_msg = ChatMessage(role="user", content=request.message, subject_id=request.subject_id)
-    session.add(user_msg)
-    session.commit()
-    session.refresh(user_msg)
-
-    # 2. Retrieve history for context (optional, RAG service uses vector store primarily)
-    # We could pass recent history to the LLM if we wanted multi-turn context
-    history_msgs = session.exec(select(ChatMessage).where(ChatMessage.subject_id == request.subject_id).order_by(ChatMessage.created_at)).all()
-    history = [{"role": m.role, "content": m.content} for m in history_msgs]
+    # 2. Generate response
+    response_data = await rag_service.generate_response(request.subject_id, request.message, history)
     
-    # 3. Generate response
-    response_data = rag_service.generate_response(request.subject_id, request.message, history)
-    
-    # 4. Save Assistant Message
-    assistant_msg = ChatMessage(role="assistant", content=response_data["answer"], subject_id=request.subject_id)
-    session.add(assistant_msg)
-    session.commit()
-    session.refresh(assistant_msg)
+    # 3. Save Assistant Message
+    message_id = await asyncio.to_thread(_save_assistant_message, request.subject_id, response_data["answer"])
     
     return ChatResponse(
         answer=response_data["answer"],
-        context_used=response_data["context_used"],
-        message_id=assistant_msg.id
+        context_used=[d["text"] for d in response_data["context_used"]],
+        message_id=message_id
     )
 
+@router.post("/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Streaming variant of POST /chat/. Responds with NDJSON events:
+      {"type": "context", "context_used": [...]}
+      {"type": "token", "content": "..."}        (repeated)
+      {"type": "done", "message_id": 1, "answer": "..."}
+    The assistant message is saved once the stream finishes.
+    """
+    # 1. Verify subject exists, save User Message and load the recent turns
+    history = await asyncio.to_thread(_save_user_message, request.subject_id, request.message)
+    if history is None:
+        raise HTTPException(status_code=404, detail="Subject not found")
+
+    # 2. Retrieval happens now; generation happens lazily while the body is streamed
+    response_data = await rag_service.stream_response(request.subject_id, request.message, history)
+    subject_id = request.subject_id
+
+    async def event_stream():
+        yield json.dumps({"type": "context", "context_used": [d["text"] for d in response_data["context_used"]]}) + "\n"
+
+        tokens = response_data["tokens"]
+        answer_parts = []
+        try:
+            async for token in tokens:
+                answer_parts.append(token)
+                yield json.dumps({"type": "token", "content": token}) + "\n"
+        finally:
+            # Runs on completion and on client disconnect, so partial answers are kept too.
+            # On disconnect the request's cancel scope is cancelled; the shield lets the save
+            # (and closing the stream, which frees its Ollama slot) finish anyway.
+            answer = "".join(answer_parts).strip()
+            message_id = None
+            with anyio.CancelScope(shield=True):
+                await tokens.aclose()
+                if answer:
+                    message_id = await asyncio.to_thread(_save_assistant_message, subject_id, answer)
+                    logger.info(f"Saved streamed answer ({len(answer)} chars) as message {message_id}")
+                else:
+                    # Client left before the first token: an empty turn would only pollute the history
+                    logger.info("Stream ended without any answer text; nothing saved")
+
+        yield json.dumps({"type": "done", "message_id": message_id, "answer": answer}) + "\n"
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
 @router.get("/{subject_id}/history", response_model=List[ChatMessageResponse])
-def get_history(subject_id: int, session: Session = Depends(get_session)):
-    messages = session.exec(select(ChatMessage).where(ChatMessage.subject_id == subject_id).order_by(ChatMessage.created_at)).all()
-    return messages
+def get_history(
+    subject_id: int,
+    before: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=200),
+    session: Session = Depends(get_session),
+):
+    """
+    The newest `limit` messages, oldest first. For older pages pass the created_at of the
+    oldest message received as `before`.
+    """
+    return _latest_messages(session, subject_id, limit, before=before)
 
 from pydantic import BaseModel
 class PDFRequest(BaseModel):
     formatted_questions: Optional[dict] = None
 
 @router.post("/{subject_id}/generate-pdf")
-def generate_pdf(subject_id: int, request: PDFRequest = None, session: Session = Depends(get_session)):
+async def generate_pdf(subject_id: int, request: PDFRequest = None):
     # 1. Verify Subject
-    subject = session.get(Subject, subject_id)
-    if not subject:
+    subject_name = await asyncio.to_thread(_subject_name, subject_id)
+    if subject_name is None:
         raise HTTPException(status_code=404, detail="Subject not found")
 
     # 2. Use Provided Content OR Generate New
@@ -62,11 +158,17 @@ def generate_pdf(subject_id: int, request: PDFRequest = None, session: Session =
         exam_data = request.formatted_questions
     else:
         # Fallback to auto-generation if no context provided (e.g. direct API access)
-        exam_data = rag_service.generate_structured_exam(subject_id)
+        exam_data = await rag_service.generate_structured_exam(subject_id)
+        if exam_data["errors"]:
+            # A paper with missing units must not be printed as if it were complete
+            raise HTTPException(
+                status_code=503,
+                detail={"message": "The exam paper could not be generated completely. Please try again.", "errors": exam_data["errors"]},
+            )
     
-    # 3. Generate PDF Binary
+    # 3. Generate PDF Binary (CPU-bound, so off the event loop)
     from app.services.pdf_generator import pdf_generator
-    pdf_buffer = pdf_generator.create_pdf(subject.name, exam_data)
+    pdf_buffer = await asyncio.to_thread(pdf_generator.create_pdf, subject_name, exam_data)
     
     # 4. Return as File Download
     from fastapi import Response
@@ -75,7 +177,7 @@ def generate_pdf(subject_id: int, request: PDFRequest = None, session: Session =
         content=pdf_bytes,
         media_type="application/pdf",
         headers={
-            "Content-Disposition": f"attachment; filename=Exam_{subject.name}.pdf",
+            "Content-Disposition": f"attachment; filename=Exam_{subject_name}.pdf",
             "Content-Length": str(len(pdf_bytes))
         }
     )
@@ -0,0 +1,47 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from app.config import settings
+from app.core.database import engine
+from app.services.embedding_service import embedding_service
+from app.services.vector_store import vector_store
+from app.services.warmup import warm_up
+
+router = APIRouter()
+
+@router.get("/live")
+def liveness():
+    """The process is up and serving requests."""
+    return {"status": "ok"}
+
+@router.get("/ready")
+def readiness():
+    """Ready for RAG traffic: warm-up has finished and the database answers."""
+    checks = {"warm_up": warm_up.state}
+    if settings.VECTOR_SERVICE_ADDRESS:
+        try:
+            info = vector_store.ping()
+            checks["vector_service"] = "ok"
+            checks["embedding_model"] = "loaded" if info["embedding_model"] else "not loaded"
+        except Exception as e:
+            checks["vector_service"] = f"error: {e}"
+    else:
+        checks["embedding_model"] = "loaded" if embedding_service.ready else "not loaded"
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        checks["database"] = "ok"
+    except Exception as e:
+        checks["database"] = f"error: {e}"
+
+    ready = warm_up.done and checks["database"] == "ok" and checks.get("vector_service", "ok") == "ok"
+    if warm_up.error:
+        checks["error"] = warm_up.error
+    return JSONResponse(status_code=200 if ready else 503, content={"status": "ready" if ready else "not ready", "checks": checks})
+
+@router.get("/metrics")
+def metrics():
+    """Embedding batch sizes and latencies, from the shared vector service when there is one."""
+    if settings.VECTOR_SERVICE_ADDRESS:
+        return vector_store.ping()["embedding_metrics"]
+    return embedding_service.metrics()
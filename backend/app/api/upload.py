@@ -1,14 +1,15 @@
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, status
 from sqlmodel import Session, select
-from typing import Optional
-from app.core.database import get_session
+from typing import Optional, Tuple
+from app.core.database import get_session, engine
 from app.models.models import Subject, Document
-from app.schemas.schemas import UploadResponse, DocumentType
-from app.services.pdf_service import PDFService
+from app.schemas.schemas import UploadResponse, DocumentType, DocumentStatus, DocumentStatusResponse
+from app.services.ingestion import ingestion_queue
 from app.services.vector_store import vector_store
 from app.config import settings
+import asyncio
+import hashlib
 import os
-import shutil
 import logging
 import uuid
 # import magic  # Removed dependency to avoid installation issues on Windows
@@ -16,13 +17,63 @@ import uuid
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+def _save_and_hash(src, file_path: str) -> str:
+    """Copies the upload to disk and returns its SHA-256, in one pass."""
+    digest = hashlib.sha256()
+    with open(file_path, "wb") as buffer:
+        while block := src.read(1024 * 1024):
+            digest.update(block)
+            buffer.write(block)
+    return digest.hexdigest()
+
+# upload_file is async so it can stream the upload to disk on a worker thread; its database
+# work runs in these sync helpers on a worker thread too, so a commit waiting on SQLite's
+# write lock (held by background ingestion) never blocks the event loop.
+
+def _subject_name(subject_id: int) -> Optional[str]:
+    with Session(engine) as session:
+        subject = session.get(Subject, subject_id)
+        return subject.name if subject else None
+
+def _add_document(subject_id: int, filename: str, file_path: str, document_type: DocumentType, content_hash: str) -> Tuple[Document, bool]:
+    """
+    Creates the queued Document row, or returns the subject's existing document with the
+    same content (and True) so the same file isn't indexed twice.
+    """
+    with Session(engine) as session:
+        existing = session.exec(
+            select(Document).where(
+                Document.subject_id == subject_id,
+                Document.content_hash == content_hash,
+                Document.status != DocumentStatus.FAILED
+            )
+        ).first()
+        if existing:
+            return existing, True
+
+        db_doc = Document(
+            filename=filename,
+            file_path=file_path, # Store the unique path
+            document_type=document_type,
+            subject_id=subject_id,
+            status=DocumentStatus.QUEUED,
+            content_hash=content_hash
+        )
+        session.add(db_doc)
+        session.commit()
+        session.refresh(db_doc)
+        return db_doc, False
+
 @router.post("/", response_model=UploadResponse)
 async def upload_file(
     file: UploadFile = File(...),
     subject_id: int = Form(...),
-    document_type: DocumentType = Form(...),
-    session: Session = Depends(get_session)
+    document_type: DocumentType = Form(...)
 ):
+    """
+    Saves the PDF and queues it for indexing. Returns right away with the document id;
+    poll GET /upload/{document_id}/status until it is "indexed" or "failed".
+    """
     # 0. Validate File Type
     if file.content_type != "application/pdf" and not file.filename.lower().endswith(".pdf"):
         raise HTTPException(
@@ -31,8 +82,8 @@ async def upload_file(
         )
 
     # 1. Verify Subject
-    subject = session.get(Subject, subject_id)
-    if not subject:
+    subject_name = await asyncio.to_thread(_subject_name, subject_id)
+    if subject_name is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail=f"Subject with ID {subject_id} not found."
@@ -40,71 +91,40 @@ async def upload_file(
 
     try:
         # 2. Save File (with unique name to avoid overwrite issues)
-        file_ext = os.path.splitext(file.filename)[1]
         unique_filename = f"{uuid.uuid4()}_{file.filename}"
         file_path = os.path.join(settings.UPLOAD_DIR, unique_filename)
         
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        # 3. Extract Text (Pre-check to ensure it's a valid PDF)
-        text = PDFService.extract_text(file_path)
-        if not text or len(text.strip()) == 0:
-            os.remove(file_path) # Cleanup
-            raise HTTPException(
-                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, 
-                detail="Could not extract text from this PDF. It might be scanned or empty."
-            )
+        content_hash = await asyncio.to_thread(_save_and_hash, file.file, file_path)
 
-        # 4. Create Document Record
-        db_doc = Document(
-            filename=file.filename,
-            file_path=file_path, # Store the unique path
-            document_type=document_type,
-            subject_id=subject_id
+        # 3. Create the Document Record, unless the same file is already in this subject
+        db_doc, duplicate = await asyncio.to_thread(
+            _add_document, subject_id, file.filename, file_path, document_type, content_hash
         )
-        session.add(db_doc)
-        session.commit()
-        session.refresh(db_doc)
+        if duplicate:
+            os.remove(file_path)
+            logger.info(f"{file.filename} is identical to document {db_doc.id}, not indexing it again")
+            return UploadResponse(
+                document_id=db_doc.id,
+                filename=db_doc.filename,
+                subject=subject_name,
+                type=db_doc.document_type,
+                status=db_doc.status,
+                duplicate=True
+            )
+
+        # 4. Extract, chunk and index in the background (see ingestion.py)
+        ingestion_queue.submit(db_doc.id)
 
-        # 5. Index in FAISS
-        chunk_data = PDFService.split_text(text)
-        chunks = [c["text"] for c in chunk_data]
-        
-        metadatas = [
-            {
-                "text": c["text"],
-                "subject_id": subject_id,
-                "document_type": document_type,
-                "filename": file.filename,
-                "doc_id": db_doc.id,
-                "unit": c["unit"],
-                "part": c["part"],
-                "co": c["co"]
-            }
-            for c in chunk_data
-        ]
-        
-        # Add to vector store (wrapping in try/except to ensure DB consistency if indexing fails)
-        try:
-            vector_store.add_texts(subject_id, chunks, metadatas)
-        except Exception as vs_e:
-            logger.error(f"Vector store indexing failed: {vs_e}")
-            # Optional: Rollback DB entry if strict consistency is needed
-            # For now, we keep the file but maybe mark it as 'unindexed' in a future schema update
-            # Continuing to return success but with a warning log
-            
         return UploadResponse(
+            document_id=db_doc.id,
             filename=file.filename,
-            subject=subject.name,
+            subject=subject_name,
             type=document_type,
-            status="Uploaded and Processed Successfully"
+            status=DocumentStatus.QUEUED
         )
 
-    except HTTPException as he:
-        raise he
     except Exception as e:
-        logger.error(f"Error processing file {file.filename}: {e}", exc_info=True)
+        logger.error(f"Error saving file {file.filename}: {e}", exc_info=True)
         # Attempt cleanup if file was saved but processing failed
         if 'file_path' in locals() and os.path.exists(file_path):
              try:
@@ -112,11 +132,32 @@ async def upload_file(
              except:
                  pass
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+
+@router.get("/{document_id}/status", response_model=DocumentStatusResponse)
+def get_upload_status(document_id: int, session: Session = Depends(get_session)):
+    doc = session.get(Document, document_id)
+    if not doc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Document with ID {document_id} not found."
+        )
+    return DocumentStatusResponse(
+        id=doc.id,
+        filename=doc.filename,
+        status=doc.status,
+        error=doc.error,
+        page_count=doc.page_count,
+        pages_done=doc.pages_done,
+        chunks_indexed=doc.chunks_indexed
+    )
+
 @router.delete("/{document_id}")
-async def delete_document(
+def delete_document(
     document_id: int,
     session: Session = Depends(get_session)
 ):
+    # Sync on purpose: FastAPI runs it in the threadpool, so remove_document waiting on the
+    # vector store's write lock (held during a compaction) doesn't stall the event loop.
     # 1. Find document
     doc = session.get(Document, document_id)
     if not doc:
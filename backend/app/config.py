@@ -8,14 +8,96 @@ class Settings(BaseSettings):
     APP_NAME: str = "Exam Gen AI"
     # Local only - no cloud keys needed
     EMBEDDING_MODEL_ID: str = "sentence-transformers/all-MiniLM-L6-v2"
+    # Inference backend: torch, torch-int8, onnx or onnx-int8 (see embedding_service.py).
+    # Changing the backend, normalisation or fp16 changes the vectors: run check_embedding_parity.py
+    # first, and reindex if the parity is too low
+    EMBEDDING_BACKEND: str = "torch"
+    EMBEDDING_ONNX_FILE: str = "" # ONNX file inside the model repo; empty = backend default
+    EMBEDDING_BATCH_SIZE: int = 32
+    EMBEDDING_THREADS: int = 0 # 0 = library default (all cores)
+    EMBEDDING_NORMALIZE: bool = False
+    EMBEDDING_FP16: bool = False
+    # Query embeddings arriving within this many ms are encoded as one batch (0 disables batching)
+    EMBEDDING_BATCH_WINDOW_MS: float = 5.0
+    EMBEDDING_MAX_BATCH: int = 64
+    # Load the model in the background at startup instead of on the first request
+    EMBEDDING_WARM_UP: bool = True
     OLLAMA_BASE_URL: str = "http://localhost:11434"
     OLLAMA_MODEL: str = "mistral"
+    # Async LLM client: generations run at once, how many may wait, and for how long
+    OLLAMA_TIMEOUT: float = 120.0
+    OLLAMA_MAX_CONCURRENCY: int = 2
+    OLLAMA_MAX_QUEUE: int = 64
+    OLLAMA_QUEUE_TIMEOUT: float = 300.0
+    # Earlier messages passed to the LLM with each chat turn: at most this many, within this
+    # many tokens (newest first)
+    CHAT_HISTORY_MESSAGES: int = 6
+    CHAT_HISTORY_TOKEN_BUDGET: int = 1024
+    # Chunks retrieved for a single-unit chat question
+    CHAT_RETRIEVAL_K: int = 12
+    # Tokens of retrieved context per prompt. Keep system prompt + history + context + answer
+    # within the model's context window (Ollama's num_ctx)
+    CONTEXT_TOKEN_BUDGET: int = 3000
+    # Exam papers are generated per unit: this many units at once, each retried on its own
+    EXAM_CONCURRENCY: int = 3
+    EXAM_PIECE_RETRIES: int = 2
+    EXAM_UNIT_CONTEXT_TOKENS: int = 1200
+    # Ollama structured output for exam pieces: "schema" (JSON schema, Ollama 0.5+), "json"
+    # (any JSON object) or "" (unconstrained)
+    EXAM_OUTPUT_FORMAT: str = "schema"
     
     # Path logic anchored to the 'backend' folder
     # Assuming config.py is in backend/app/config.py
     ROOT_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     UPLOAD_DIR: str = os.path.join(ROOT_DIR, "uploads")
     FAISS_INDEX_DIR: str = os.path.join(ROOT_DIR, "faiss_index")
+    # Unix socket of the shared vector service (python -m app.services.vector_service), e.g.
+    # backend/vector_service.sock. Empty = every API process embeds and searches in-process
+    VECTOR_SERVICE_ADDRESS: str = ""
+    # Shared secret for the socket handshake. Empty = the service generates one on every start
+    # and writes it to <VECTOR_SERVICE_ADDRESS>.key (mode 0600), where workers read it
+    VECTOR_SERVICE_AUTHKEY: str = ""
+    VECTOR_SERVICE_CONNECT_TIMEOUT: float = 60.0 # how long workers wait for the service at startup
+    # Embeddings of chunk texts, reused by re-uploads and reindexing (0 MB disables the cache)
+    EMBEDDING_CACHE_PATH: str = os.path.join(ROOT_DIR, "embedding_cache.db")
+    EMBEDDING_CACHE_MAX_MB: int = 512
+    # In-memory LRU caches for repeated chat prompts: query embeddings and search results (TTL in seconds)
+    QUERY_EMBEDDING_CACHE_SIZE: int = 1024
+    QUERY_EMBEDDING_CACHE_TTL: float = 3600.0
+    RETRIEVAL_CACHE_SIZE: int = 512
+    RETRIEVAL_CACHE_TTL: float = 600.0
+    # Background threads extracting and embedding uploaded PDFs
+    INGESTION_WORKERS: int = 2
+    # Chunks embedded and added to the index together; bounds ingestion memory
+    INGESTION_BATCH_SIZE: int = 128
+    # PDFs with this many pages are extracted in a process pool of PDF_EXTRACT_WORKERS (0 = CPU count)
+    PDF_PARALLEL_MIN_PAGES: int = 32
+    PDF_EXTRACT_WORKERS: int = 0
+    # Subject indices are loaded on first use; least recently used ones are unloaded past this budget
+    VECTOR_CACHE_MAX_MB: int = 1024
+    # Memory-map base segments instead of reading them (pages stay in the OS cache, not the heap)
+    VECTOR_MMAP_BASE: bool = False
+    # Rebuild a subject's index once this fraction of its vectors belongs to deleted chunks
+    VECTOR_COMPACTION_THRESHOLD: float = 0.2
+    # Uploads append to small delta segments; more than VECTOR_MAX_DELTAS triggers a background merge
+    VECTOR_DELTA_MAX_CHUNKS: int = 2048
+    VECTOR_MAX_DELTAS: int = 4
+    # Subjects switch from exact (flat) search to an ANN index once they hold this many chunks
+    VECTOR_ANN_THRESHOLD: int = 50000
+    VECTOR_ANN_INDEX_TYPE: str = "hnsw" # "hnsw" or "ivfpq"
+    # Filtered searches on ANN subjects score up to this many matching chunks exactly
+    VECTOR_EXACT_FILTER_MAX: int = 4096
+    # Hybrid retrieval: BM25 keyword results fused with the vector results by reciprocal rank
+    HYBRID_SEARCH: bool = True
+    HYBRID_CANDIDATES: int = 50 # results taken from each side before fusing
+    HYBRID_RRF_K: int = 60
+    # Recall vs latency: higher efSearch / nprobe = better recall, slower queries
+    HNSW_M: int = 32
+    HNSW_EF_CONSTRUCTION: int = 80
+    HNSW_EF_SEARCH: int = 64
+    IVF_NLIST: int = 0 # 0 = 4 * sqrt(chunk count)
+    IVF_PQ_M: int = 48 # sub-quantizers; must divide the embedding dimension
+    IVF_NPROBE: int = 16
     ALLOWED_ORIGINS: list = ["http://localhost:5173"]
 
     class Config:
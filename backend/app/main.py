@@ -1,8 +1,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import subjects, upload, chat
+from app.api import subjects, upload, chat, health
 from app.config import settings
 from app.core.database import create_db_and_tables
+from app.services.llm_client import llm_client
+from app.services.ingestion import ingestion_queue
+from app.services import pdf_service
+from app.services.embedding_cache import embedding_cache
+from app.services.warmup import warm_up
 
 app = FastAPI(title=settings.APP_NAME)
 
@@ -19,11 +24,21 @@ app.add_middleware(
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
+    # Model loading and resuming ingestion happen in the background; see /health/ready
+    warm_up.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    ingestion_queue.shutdown()
+    pdf_service.shutdown_executor()
+    embedding_cache.close()
+    await llm_client.aclose()
 
 # Routers
 app.include_router(subjects.router, prefix="/subjects", tags=["Subjects"])
 app.include_router(upload.router, prefix="/upload", tags=["Upload"])
 app.include_router(chat.router, prefix="/chat", tags=["Chat"])
+app.include_router(health.router, prefix="/health", tags=["Health"])
 
 @app.get("/")
 def read_root():
@@ -1,4 +1,5 @@
 from typing import Optional, List
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 from datetime import datetime
 
@@ -16,11 +17,21 @@ class Document(SQLModel, table=True):
     file_path: str
     uploaded_at: datetime = Field(default_factory=datetime.utcnow)
     document_type: str # notes or question_bank
+    content_hash: Optional[str] = Field(default=None, index=True) # sha256 of the file, for duplicate uploads
+    # Ingestion progress: queued, extracting, embedding, indexed or failed (see ingestion.py)
+    status: str = Field(default="queued", sa_column_kwargs={"server_default": "indexed"})
+    error: Optional[str] = None
+    # Progress, updated after every indexed batch
+    page_count: Optional[int] = None
+    pages_done: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    chunks_indexed: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
     
     subject_id: Optional[int] = Field(default=None, foreign_key="subject.id")
     subject: Optional[Subject] = Relationship(back_populates="documents")
 
 class ChatMessage(SQLModel, table=True):
+    # History is always read per subject in time order, a page at a time
+    __table_args__ = (Index("ix_chatmessage_subject_id_created_at", "subject_id", "created_at"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     role: str # user or assistant
     content: str
@@ -28,3 +39,30 @@ class ChatMessage(SQLModel, table=True):
     
     subject_id: Optional[int] = Field(default=None, foreign_key="subject.id")
     subject: Optional[Subject] = Relationship(back_populates="messages")
+
+class Chunk(SQLModel, table=True):
+    """
+    A piece of an uploaded document. Its id is also the vector id in the subject's FAISS index.
+    Identical chunks (same content_hash) within a subject are stored once and shared by every
+    document that contains them through ChunkRef; doc_id/filename name one of those documents.
+    """
+    __table_args__ = {"sqlite_autoincrement": True} # never reuse ids of purged chunks
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    text: str
+    unit: Optional[str] = None
+    part: Optional[str] = None
+    co: Optional[str] = None
+    document_type: str
+    filename: str
+    deleted: bool = Field(default=False) # tombstone: vector still in the index until compaction
+    content_hash: Optional[str] = Field(default=None, index=True) # sha256 of text and structural tags
+    ref_count: int = Field(default=1, sa_column_kwargs={"server_default": "1"}) # number of ChunkRef rows
+
+    subject_id: int = Field(foreign_key="subject.id", index=True)
+    doc_id: Optional[int] = Field(default=None, foreign_key="document.id", index=True)
+
+class ChunkRef(SQLModel, table=True):
+    """A document containing a (possibly shared) chunk."""
+    chunk_id: int = Field(foreign_key="chunk.id", primary_key=True)
+    doc_id: int = Field(foreign_key="document.id", primary_key=True, index=True)
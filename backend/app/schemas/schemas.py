@@ -14,17 +14,37 @@ class DocumentType(str, Enum):
     NOTES = "notes"
     QUESTION_BANK = "question_bank"
 
+class DocumentStatus(str, Enum):
+    QUEUED = "queued"
+    EXTRACTING = "extracting"
+    EMBEDDING = "embedding"
+    INDEXED = "indexed"
+    FAILED = "failed"
+
 class DocumentResponse(BaseModel):
     id: int
     filename: str
     document_type: str
     uploaded_at: datetime
+    status: DocumentStatus
+    error: Optional[str] = None
 
 class UploadResponse(BaseModel):
+    document_id: int
     filename: str
     subject: str
     type: DocumentType
-    status: str
+    status: DocumentStatus
+    duplicate: bool = False # identical file already uploaded to this subject; document_id is that one
+
+class DocumentStatusResponse(BaseModel):
+    id: int
+    filename: str
+    status: DocumentStatus
+    error: Optional[str] = None
+    page_count: Optional[int] = None
+    pages_done: int = 0
+    chunks_indexed: int = 0
 
 class ChatRequest(BaseModel):
     subject_id: int
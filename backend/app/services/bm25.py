@@ -0,0 +1,100 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Too common to say anything about a chunk; skipping them keeps long postings out of queries
+STOPWORDS = frozenset(
+    "a an and are as at be by for from give how i in is it me of on or the this to what which with".split()
+)
+
+# Okapi BM25 parameters
+K1 = 1.5
+B = 0.75
+# Query terms found in more than this fraction of chunks barely move the ranking but cost a
+# pass over most postings; they are skipped when the query has rarer terms
+COMMON_TERM_FRACTION = 0.5
+
+# Approximate heap cost (measured with tracemalloc on CPython 3.11) of one (term, chunk)
+# posting, including its share of the chunk's term tuple, and of one term / one chunk
+POSTING_BYTES = 100
+TERM_BYTES = 200
+CHUNK_BYTES = 100
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+class BM25Index:
+    """
+    In-memory BM25 inverted index over the chunk texts of one subject, keyed by chunk id.
+    Catches exact terms (algorithm names, CO codes, ...) that embedding search ranks poorly.
+    """
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, int]] = {} # term -> chunk id -> term frequency
+        # Terms of each chunk, so it can be removed after its text is gone
+        self.chunk_terms: Dict[int, Tuple[str, ...]] = {}
+        self.chunk_lengths: Dict[int, int] = {}
+        self.total_length = 0
+        self.posting_count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.chunk_lengths)
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated memory held by the index."""
+        return self.posting_count * POSTING_BYTES + len(self.postings) * TERM_BYTES + len(self.chunk_lengths) * CHUNK_BYTES
+
+    def add(self, texts: Dict[int, str]):
+        with self._lock:
+            for chunk_id, text in texts.items():
+                if chunk_id in self.chunk_lengths:
+                    continue
+                tokens = tokenize(text)
+                counts = Counter(tokens)
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[chunk_id] = tf
+                self.chunk_terms[chunk_id] = tuple(counts)
+                self.chunk_lengths[chunk_id] = len(tokens)
+                self.total_length += len(tokens)
+                self.posting_count += len(counts)
+
+    def remove(self, chunk_ids: Iterable[int]):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                terms = self.chunk_terms.pop(chunk_id, None)
+                if terms is None:
+                    continue
+                self.total_length -= self.chunk_lengths.pop(chunk_id)
+                self.posting_count -= len(terms)
+                for term in terms:
+                    posting = self.postings[term]
+                    del posting[chunk_id]
+                    if not posting:
+                        del self.postings[term]
+
+    def search(self, query: str, k: int, allowed: Optional[Set[int]] = None) -> List[Tuple[int, float]]:
+        """Top k (chunk id, score) pairs, best first, optionally only among `allowed` ids."""
+        terms = set(tokenize(query))
+        scores: Dict[int, float] = defaultdict(float)
+        with self._lock:
+            n = len(self.chunk_lengths)
+            if not n or not terms:
+                return []
+            avg_length = self.total_length / n or 1.0
+            postings = {term: self.postings[term] for term in terms if term in self.postings}
+            rare = {term: posting for term, posting in postings.items() if len(posting) <= COMMON_TERM_FRACTION * n}
+            for term, posting in (rare or postings).items():
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for chunk_id, tf in posting.items():
+                    if allowed is not None and chunk_id not in allowed:
+                        continue
+                    norm = K1 * (1 - B + B * self.chunk_lengths[chunk_id] / avg_length)
+                    scores[chunk_id] += idf * tf * (K1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=itemgetter(1))
@@ -0,0 +1,74 @@
+from collections import Counter
+from typing import Callable, Dict, List, Set
+from app.services.bm25 import tokenize
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Relevance vs novelty in maximal marginal relevance: 1.0 = rank order only
+MMR_LAMBDA = 0.7
+# Chunks sharing at least this fraction of their terms with one already packed are dropped
+DUPLICATE_THRESHOLD = 0.8
+# Tokens for the separator between two chunks
+SEPARATOR_TOKENS = 4
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text with LLaMA/Mistral-style tokenizers
+    return (len(text) + 3) // 4
+
+def format_chunk(doc: Dict) -> str:
+    """A retrieved chunk as it appears in a chat prompt: a source line, then the text."""
+    meta = doc.get("metadata", {})
+    source_info = f"[Source: {meta.get('filename', 'Unknown')} | Unit: {meta.get('unit', 'N/A')} | Part: {meta.get('part', 'N/A')}]"
+    return f"{source_info}\n{doc['text']}"
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def pack_context(docs: List[Dict], budget: int, render: Callable[[Dict], str] = format_chunk) -> List[Dict]:
+    """
+    Picks the chunks for a prompt, in the order they should appear, until `budget` tokens
+    (of render(doc) plus separators) are used. `docs` are in order of preference.
+
+    Each step takes a chunk from the unit with the fewest packed so far, so every unit
+    keeps a share of the budget. Within those, the chunk with the best maximal marginal
+    relevance wins (rank-based relevance minus Jaccard overlap with the packed chunks).
+    Near-duplicates (DUPLICATE_THRESHOLD) and chunks that no longer fit are dropped.
+    """
+    if not docs:
+        return []
+    candidates = [
+        {
+            "doc": doc,
+            "tokens": estimate_tokens(render(doc)) + SEPARATOR_TOKENS,
+            "terms": set(tokenize(doc.get("text", ""))),
+            "relevance": 1.0 - rank / len(docs),
+            "unit": doc.get("metadata", {}).get("unit"),
+            "redundancy": 0.0, # highest overlap with any packed chunk
+        }
+        for rank, doc in enumerate(docs)
+    ]
+
+    packed: List[Dict] = []
+    per_unit: Counter = Counter()
+    used = 0
+    while candidates:
+        candidates = [c for c in candidates if used + c["tokens"] <= budget and c["redundancy"] < DUPLICATE_THRESHOLD]
+        if not candidates:
+            break
+        fewest = min(per_unit[c["unit"]] for c in candidates)
+        best = max(
+            (c for c in candidates if per_unit[c["unit"]] == fewest),
+            key=lambda c: MMR_LAMBDA * c["relevance"] - (1 - MMR_LAMBDA) * c["redundancy"],
+        )
+        candidates.remove(best)
+        packed.append(best["doc"])
+        per_unit[best["unit"]] += 1
+        used += best["tokens"]
+        for c in candidates:
+            c["redundancy"] = max(c["redundancy"], _jaccard(c["terms"], best["terms"]))
+
+    logger.info(f"Packed {len(packed)} of {len(docs)} chunks into {used}/{budget} context tokens")
+    return packed
@@ -0,0 +1,116 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+from typing import Dict, List, Optional
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The row count is tracked in memory; it is re-read with COUNT(*) only when it suggests the
+# cache is full, or after this many writes (other processes may write to the same file)
+RECOUNT_EVERY = 100
+
+class EmbeddingCache:
+    """
+    On-disk cache of embeddings keyed by (model key, sha256(text)), stored as float32 (or float16) blobs
+    in a small SQLite database next to the FAISS indices. Least recently used rows are
+    evicted once the cache grows past EMBEDDING_CACHE_MAX_MB.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._rows = 0 # upper bound on the rows in the table, as far as this process knows
+        self._writes_since_count = 0
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding ("
+                " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL,"
+                " PRIMARY KEY (model, text_hash))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_embedding_last_used ON embedding (last_used)")
+            self._conn = conn
+            self._count_rows()
+        return self._conn
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, hashes: List[str], dtype: str = 'float32') -> Dict[str, np.ndarray]:
+        """Cached vectors for whichever of these hashes are present."""
+        found = {}
+        with self._lock:
+            conn = self._get_conn()
+            unique = list(dict.fromkeys(hashes))
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embedding WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=dtype).astype('float32')
+            if found:
+                conn.executemany(
+                    "UPDATE embedding SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(time.time(), model, text_hash) for text_hash in found],
+                )
+                conn.commit()
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, np.ndarray], dtype: str = 'float32'):
+        if not vectors:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._get_conn()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embedding (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, text_hash, np.asarray(vector, dtype=dtype).tobytes(), now) for text_hash, vector in vectors.items()],
+            )
+            conn.commit()
+            # Replaced rows are counted too, which only makes the bound looser
+            self._rows += len(vectors)
+            self._writes_since_count += 1
+            self._evict(conn, len(next(iter(vectors.values()))) * np.dtype(dtype).itemsize)
+
+    def _count_rows(self):
+        (self._rows,) = self._conn.execute("SELECT COUNT(*) FROM embedding").fetchone()
+        self._writes_since_count = 0
+
+    def _evict(self, conn: sqlite3.Connection, vector_bytes: int):
+        # ~100 bytes of key and page overhead per row on top of the vector itself
+        max_rows = settings.EMBEDDING_CACHE_MAX_MB * 1024 * 1024 // (vector_bytes + 100)
+        if self._rows <= max_rows and self._writes_since_count < RECOUNT_EVERY:
+            return
+        self._count_rows()
+        if self._rows <= max_rows:
+            return
+        # Trim to 90% so eviction doesn't run on every insert
+        excess = self._rows - int(max_rows * 0.9)
+        conn.execute(
+            "DELETE FROM embedding WHERE rowid IN (SELECT rowid FROM embedding ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        conn.commit()
+        self._rows -= excess
+        logger.info(f"Evicted {excess} embeddings from the cache")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+embedding_cache = EmbeddingCache(settings.EMBEDDING_CACHE_PATH)
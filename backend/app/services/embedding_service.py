@@ -1,18 +1,239 @@
-from sentence_transformers import SentenceTransformer
+import queue
+import threading
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
 from app.config import settings
+from app.services.embedding_cache import embedding_cache
+from app.services.cache import TTLCache, normalize_query
 import logging
 
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
 logger = logging.getLogger(__name__)
 
+# EMBEDDING_BACKEND values:
+#   torch      - the SentenceTransformer as-is (float32 PyTorch)
+#   torch-int8 - PyTorch with its Linear layers dynamically quantized to int8
+#   onnx       - ONNX Runtime (needs `sentence-transformers[onnx]`), EMBEDDING_ONNX_FILE or onnx/model.onnx
+#   onnx-int8  - ONNX Runtime with an int8-quantized export (EMBEDDING_ONNX_FILE or onnx/model_quint8_avx2.onnx)
+EMBEDDING_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+def load_model(backend: str) -> "SentenceTransformer":
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}, expected one of {EMBEDDING_BACKENDS}")
+    # Imported here: sentence_transformers pulls in torch, which takes seconds
+    from sentence_transformers import SentenceTransformer
+
+    if backend.startswith("onnx"):
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        if settings.EMBEDDING_THREADS:
+            session_options.intra_op_num_threads = settings.EMBEDDING_THREADS
+        default_file = "onnx/model_quint8_avx2.onnx" if backend == "onnx-int8" else "onnx/model.onnx"
+        model_kwargs = {"file_name": settings.EMBEDDING_ONNX_FILE or default_file, "session_options": session_options}
+        return SentenceTransformer(settings.EMBEDDING_MODEL_ID, backend="onnx", model_kwargs=model_kwargs)
+
+    model = SentenceTransformer(settings.EMBEDDING_MODEL_ID)
+    if settings.EMBEDDING_THREADS or backend == "torch-int8":
+        import torch
+
+        if settings.EMBEDDING_THREADS:
+            torch.set_num_threads(settings.EMBEDDING_THREADS)
+        if backend == "torch-int8":
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+class QueryBatcher:
+    """
+    Coalesces concurrent single-text encodes into one model call. The first request of a
+    batch waits at most `window` seconds for others to join (up to `max_batch` texts); a
+    background thread runs the batch and hands each caller its vector.
+    """
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], window: float, max_batch: int):
+        self._encode = encode
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Tuple[str, Future, float]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        # Metrics: totals, plus the most recent batches/requests for percentiles
+        self.requests = 0
+        self.batches = 0
+        self._batch_sizes: deque = deque(maxlen=1000)
+        self._latencies: deque = deque(maxlen=1000) # seconds from submit to result
+
+    def encode(self, text: str) -> np.ndarray:
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name="embed-batcher", daemon=True)
+                    self._thread.start()
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future.result()
+
+    def _collect(self) -> List[Tuple[str, Future, float]]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            # Concurrent requests for the same query are encoded once
+            unique = list(dict.fromkeys(text for text, _, _ in batch))
+            try:
+                vectors = dict(zip(unique, self._encode(unique)))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            for text, future, submitted in batch:
+                future.set_result(vectors[text])
+                self._latencies.append(done - submitted)
+            self.requests += len(batch)
+            self.batches += 1
+            self._batch_sizes.append(len(batch))
+
+    def stats(self) -> Dict[str, float]:
+        sizes = np.array(self._batch_sizes, dtype='float64')
+        latencies = np.array(self._latencies, dtype='float64') * 1000
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": float(sizes.mean()) if len(sizes) else 0.0,
+            "max_batch_size": int(sizes.max()) if len(sizes) else 0,
+            "latency_ms_p50": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            "latency_ms_p95": float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
 class EmbeddingService:
+    """
+    The model is loaded on first use (or by warm_up() at startup), not at import time,
+    so the API can start serving before it is ready.
+    """
     def __init__(self):
-        logger.info(f"Loading embedding model: {settings.EMBEDDING_MODEL_ID}")
-        self.model = SentenceTransformer(settings.EMBEDDING_MODEL_ID)
+        self._model: Optional["SentenceTransformer"] = None
+        self._load_lock = threading.Lock()
+        # Chat queries repeat a lot; their embeddings are kept in memory for a while
+        self.query_cache = TTLCache(settings.QUERY_EMBEDDING_CACHE_SIZE, settings.QUERY_EMBEDDING_CACHE_TTL)
+        # Query embeddings from concurrent requests are encoded together
+        self.batcher = QueryBatcher(self._encode, settings.EMBEDDING_BATCH_WINDOW_MS / 1000, settings.EMBEDDING_MAX_BATCH)
+
+    @property
+    def model(self) -> "SentenceTransformer":
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    logger.info(f"Loading embedding model: {settings.EMBEDDING_MODEL_ID} ({settings.EMBEDDING_BACKEND})")
+                    self._model = load_model(settings.EMBEDDING_BACKEND)
+        return self._model
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    def warm_up(self):
+        """Loads the model and runs one encode, so the first real request doesn't pay for either."""
+        self.model.encode(["warm up"], batch_size=1)
+
+    @property
+    def model_key(self) -> str:
+        """Identifies the vectors this service produces; cached embeddings are keyed by it."""
+        key = f"{settings.EMBEDDING_MODEL_ID}|{settings.EMBEDDING_BACKEND}"
+        if settings.EMBEDDING_BACKEND.startswith("onnx") and settings.EMBEDDING_ONNX_FILE:
+            key += f"|{settings.EMBEDDING_ONNX_FILE}"
+        if settings.EMBEDDING_NORMALIZE:
+            key += "|norm"
+        if settings.EMBEDDING_FP16:
+            key += "|fp16"
+        return key
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(
+            texts,
+            batch_size=settings.EMBEDDING_BATCH_SIZE,
+            normalize_embeddings=settings.EMBEDDING_NORMALIZE,
+            convert_to_numpy=True,
+        )
+        if settings.EMBEDDING_FP16:
+            # Rounded to half precision (and cached as such); FAISS still gets float32
+            vectors = vectors.astype('float16')
+        return np.asarray(vectors, dtype='float32')
 
     def generate_embedding(self, text: str) -> list:
-        return self.model.encode(text).tolist()
+        key = (self.model_key, normalize_query(text))
+        embedding = self.query_cache.get(key)
+        if embedding is None:
+            if settings.EMBEDDING_BATCH_WINDOW_MS > 0:
+                embedding = self.batcher.encode(text).tolist()
+            else:
+                embedding = self._encode([text])[0].tolist()
+            self.query_cache.put(key, embedding)
+        return list(embedding)
+
+    def metrics(self) -> Dict[str, Dict]:
+        return {
+            "query_batches": self.batcher.stats(),
+            "query_cache": {"hits": self.query_cache.hits, "misses": self.query_cache.misses},
+        }
+
+    def encode_batch(self, texts: list[str]) -> np.ndarray:
+        """
+        Embeddings as one float32 array, without the per-float list conversion.
+        Texts embedded before (by this model) come from the on-disk embedding cache.
+        """
+        if settings.EMBEDDING_CACHE_MAX_MB <= 0 or not texts:
+            return self._encode(texts)
+
+        dtype = 'float16' if settings.EMBEDDING_FP16 else 'float32'
+        hashes = [embedding_cache.text_hash(text) for text in texts]
+        cached = embedding_cache.get_many(self.model_key, hashes, dtype=dtype)
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash] = text
+        if missing:
+            vectors = self._encode(list(missing.values()))
+            computed = dict(zip(missing, vectors))
+            embedding_cache.put_many(self.model_key, computed, dtype=dtype)
+            cached.update(computed)
+        return np.stack([cached[text_hash] for text_hash in hashes]).astype('float32', copy=False)
 
-    def generate_embeddings(self, texts: list[str]) -> list:
-        return self.model.encode(texts).tolist()
+    def parity_check(self, texts: List[str]) -> Dict[str, float]:
+        """
+        Compares the configured backend with the reference float32 PyTorch model on `texts`.
+        Returns the mean/min cosine similarity between the two embeddings of each text and
+        the largest L2 distance between them (which is what FAISS ranks by).
+        """
+        reference_model = load_model("torch")
+        reference = np.asarray(reference_model.encode(
+            texts,
+            batch_size=settings.EMBEDDING_BATCH_SIZE,
+            normalize_embeddings=settings.EMBEDDING_NORMALIZE,
+            convert_to_numpy=True,
+        ), dtype='float32')
+        current = self._encode(texts)
+        cosine = (current * reference).sum(axis=1) / (np.linalg.norm(current, axis=1) * np.linalg.norm(reference, axis=1))
+        return {
+            "texts": len(texts),
+            "mean_cosine": float(cosine.mean()),
+            "min_cosine": float(cosine.min()),
+            "max_l2": float(np.linalg.norm(current - reference, axis=1).max()),
+        }
 
 embedding_service = EmbeddingService()
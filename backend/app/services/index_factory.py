@@ -0,0 +1,71 @@
+import faiss
+import numpy as np
+from typing import Optional
+from app.config import settings
+
+# Index tiers, smallest to largest corpus:
+#   flat  - IndexIDMap2(IndexFlatL2): exact brute force, cheap updates
+#   hnsw  - IndexIDMap2(IndexHNSWFlat): graph search, keeps full vectors, no in-place removal
+#   ivfpq - IndexIVFPQ with a hashtable direct map: trained, compressed, supports ids natively
+INDEX_KINDS = ("flat", "hnsw", "ivfpq")
+
+def new_index(kind: str, dimension: int, training_vectors: Optional[np.ndarray] = None) -> faiss.Index:
+    """Creates an empty index of the given tier. IVF-PQ is trained on `training_vectors`."""
+    if kind == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dimension, settings.HNSW_M)
+        hnsw.hnsw.efConstruction = settings.HNSW_EF_CONSTRUCTION
+        return faiss.IndexIDMap2(hnsw)
+
+    if kind == "ivfpq":
+        n = len(training_vectors)
+        nlist = settings.IVF_NLIST or max(1, int(4 * np.sqrt(n)))
+        ivf = faiss.IndexIVFPQ(faiss.IndexFlatL2(dimension), dimension, nlist, settings.IVF_PQ_M, 8)
+        ivf.train(training_vectors)
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return ivf
+
+    return faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+
+def index_kind(index: faiss.Index) -> str:
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivfpq"
+    return "flat"
+
+def target_kind(current_kind: str, live_count: int) -> str:
+    """
+    The tier a subject with `live_count` chunks should use. Subjects move up once they pass
+    VECTOR_ANN_THRESHOLD and only move back to flat below half of it, so a subject hovering
+    around the threshold is not rebuilt on every upload.
+    """
+    threshold = settings.VECTOR_ANN_THRESHOLD
+    if current_kind == "flat":
+        return settings.VECTOR_ANN_INDEX_TYPE if live_count >= threshold else "flat"
+    return settings.VECTOR_ANN_INDEX_TYPE if live_count >= threshold // 2 else "flat"
+
+def search_params(index: faiss.Index, k: int, sel: Optional[faiss.IDSelector] = None) -> Optional[faiss.SearchParameters]:
+    """Search parameters carrying the recall/latency knobs of the index tier plus an optional selector."""
+    kind = index_kind(index)
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=max(settings.HNSW_EF_SEARCH, k))
+    if kind == "ivfpq":
+        return faiss.SearchParametersIVF(sel=sel, nprobe=settings.IVF_NPROBE)
+    return faiss.SearchParameters(sel=sel) if sel is not None else None
+
+def reconstruct(index: faiss.Index, ids: np.ndarray) -> np.ndarray:
+    """Stored vectors for the given ids (approximate for IVF-PQ)."""
+    if len(ids) == 0:
+        return np.zeros((0, index.d), dtype='float32')
+    return np.vstack([index.reconstruct(int(i)) for i in ids]).astype('float32')
+
+def supports_removal(index: faiss.Index) -> bool:
+    return index_kind(index) != "hnsw"
+
+def remove_ids(index: faiss.Index, ids: np.ndarray):
+    if index_kind(index) == "ivfpq":
+        # The hashtable direct map only accepts an explicit id array
+        index.remove_ids(faiss.IDSelectorArray(ids))
+    else:
+        index.remove_ids(faiss.IDSelectorBatch(ids))
@@ -0,0 +1,162 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional
+from sqlmodel import Session, select, col, update
+from app.config import settings
+from app.core.database import engine
+from app.models.models import Document
+from app.schemas.schemas import DocumentStatus
+from app.services.pdf_service import PDFService
+from app.services.vector_store import vector_store
+
+logger = logging.getLogger(__name__)
+
+class IngestionQueue:
+    """
+    Runs PDF extraction, chunking and embedding for uploaded documents off the event loop.
+    Progress is written to Document.status so clients can poll it; a failure leaves the
+    reason in Document.error.
+    """
+    def __init__(self, store=None):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # The shared vector service passes its own in-process store
+        self.store = store if store is not None else vector_store
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=settings.INGESTION_WORKERS, thread_name_prefix="ingest")
+        return self._executor
+
+    def submit(self, document_id: int):
+        self._get_executor().submit(self._run, document_id)
+
+    def resume_pending(self):
+        """
+        Re-queues documents whose ingestion was interrupted by a restart. Must run in one
+        process only (see warmup.py): the single API process, or the shared vector service.
+        Interrupted documents are claimed with a conditional UPDATE first, so one that
+        changed status in the meantime is left alone.
+        """
+        unfinished = [DocumentStatus.QUEUED, DocumentStatus.EXTRACTING, DocumentStatus.EMBEDDING]
+        with Session(engine) as session:
+            docs = session.exec(select(Document).where(col(Document.status).in_(unfinished))).all()
+            pending = [(doc.id, doc.subject_id, doc.status) for doc in docs]
+
+        for document_id, subject_id, doc_status in pending:
+            with Session(engine) as session:
+                claimed = session.execute(
+                    update(Document)
+                    .where(Document.id == document_id, Document.status == doc_status)
+                    .values(status=DocumentStatus.QUEUED)
+                ).rowcount == 1
+                session.commit()
+            if not claimed:
+                continue
+            logger.info(f"Resuming ingestion of document {document_id}")
+            if doc_status != DocumentStatus.QUEUED:
+                # Drop batches a previous, interrupted run may already have indexed
+                self.store.remove_document(subject_id, document_id)
+            self.submit(document_id)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @staticmethod
+    def _update(document_id: int, **fields) -> bool:
+        """Sets Document fields. Returns False if the document was deleted in the meantime."""
+        with Session(engine) as session:
+            doc = session.get(Document, document_id)
+            if not doc:
+                return False
+            for field, value in fields.items():
+                setattr(doc, field, value)
+            session.add(doc)
+            session.commit()
+            return True
+
+    @staticmethod
+    def _batched(chunks: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _run(self, document_id: int):
+        """
+        Streams the PDF through extract -> chunk -> embed -> index. Pages are read lazily,
+        chunks are embedded INGESTION_BATCH_SIZE at a time and each batch is added to the
+        index before the next is read, so memory does not grow with the document.
+        """
+        with Session(engine) as session:
+            # Only one run per document: whoever moves it out of "queued" first does it
+            claimed = session.execute(
+                update(Document)
+                .where(Document.id == document_id, Document.status == DocumentStatus.QUEUED)
+                .values(status=DocumentStatus.EXTRACTING)
+            ).rowcount == 1
+            session.commit()
+            if not claimed:
+                return
+            doc = session.get(Document, document_id)
+            if not doc:
+                return
+            file_path, filename = doc.file_path, doc.filename
+            subject_id, document_type = doc.subject_id, doc.document_type
+
+        pages_done = 0
+        chunks_indexed = 0
+
+        def pages():
+            nonlocal pages_done
+            for page in PDFService.iter_pages(file_path):
+                yield page
+                pages_done += 1
+
+        try:
+            page_count = PDFService.page_count(file_path)
+            if not self._update(document_id, status=DocumentStatus.EXTRACTING, error=None, page_count=page_count, pages_done=0, chunks_indexed=0):
+                return
+
+            for batch in self._batched(PDFService.iter_chunks(pages()), settings.INGESTION_BATCH_SIZE):
+                metadatas = [
+                    {
+                        "text": c["text"],
+                        "subject_id": subject_id,
+                        "document_type": document_type,
+                        "filename": filename,
+                        "doc_id": document_id,
+                        "unit": c["unit"],
+                        "part": c["part"],
+                        "co": c["co"]
+                    }
+                    for c in batch
+                ]
+                self.store.add_texts(subject_id, [c["text"] for c in batch], metadatas)
+                chunks_indexed += len(batch)
+                if not self._update(document_id, status=DocumentStatus.EMBEDDING, pages_done=pages_done, chunks_indexed=chunks_indexed):
+                    # Deleted while it was being indexed
+                    self.store.remove_document(subject_id, document_id)
+                    return
+
+            if chunks_indexed == 0:
+                self._update(document_id, status=DocumentStatus.FAILED, error="Could not extract text from this PDF. It might be scanned or empty.")
+                return
+
+            if not self._update(document_id, status=DocumentStatus.INDEXED, pages_done=page_count):
+                self.store.remove_document(subject_id, document_id)
+                return
+            logger.info(f"Indexed document {document_id} ({filename}): {chunks_indexed} chunks")
+        except Exception as e:
+            logger.error(f"Ingestion of document {document_id} ({filename}) failed: {e}", exc_info=True)
+            if chunks_indexed:
+                # Don't leave a half-indexed document searchable
+                self.store.remove_document(subject_id, document_id)
+            self._update(document_id, status=DocumentStatus.FAILED, error=str(e))
+
+ingestion_queue = IngestionQueue()
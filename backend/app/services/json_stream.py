@@ -0,0 +1,82 @@
+import json
+import logging
+from typing import Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class JSONItemStream:
+    """
+    Incremental parser for a streamed JSON object whose values are arrays of objects, e.g.
+    {"part_a": [{...}, {...}], "part_b": [{...}]}.
+
+    feed() takes the text as it arrives and returns every array element that closed in it,
+    as (key, element) pairs. Elements are parsed one at a time, so the ones completed before
+    a malformed or cut-off tail are kept. Text before the opening brace (a markdown fence)
+    and after the closing one is ignored, as are array elements that are not objects.
+    """
+    def __init__(self):
+        self.depth = 0
+        self.complete = False # the root object has closed
+        self.started = False # the opening brace has been seen
+        self._in_string = False
+        self._escape = False
+        self._string: List[str] = [] # a string at the root level, possibly a key
+        self._key: Optional[str] = None # key of the value being read
+        self._array = False # the value being read is an array
+        self._item: List[str] = [] # characters of the object element being read, if any
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        items = []
+        for ch in text:
+            if self.complete:
+                break
+            if not self.started:
+                if ch == '{':
+                    self.started = True
+                    self.depth = 1
+                continue
+            if self._item:
+                self._item.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    continue
+                if self.depth == 1:
+                    self._string.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self.depth == 1:
+                    self._string = []
+            elif ch == ':' and self.depth == 1:
+                self._key = "".join(self._string)
+            elif ch in '{[':
+                self.depth += 1
+                if self.depth == 2:
+                    self._array = ch == '['
+                elif self.depth == 3 and self._array and ch == '{':
+                    self._item = [ch]
+            elif ch in '}]':
+                if self.depth == 3 and self._item:
+                    item = self._parse_item()
+                    if item is not None:
+                        items.append((self._key, item))
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+        return items
+
+    def _parse_item(self) -> Optional[Any]:
+        text = "".join(self._item)
+        self._item = []
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Skipping malformed JSON element ({e}): {text[:80]!r}")
+            return None
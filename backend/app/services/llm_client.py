@@ -0,0 +1,98 @@
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import httpx
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+class LLMBusyError(Exception):
+    """Raised when the Ollama request queue is full or a queued request waited too long."""
+    pass
+
+class OllamaClient:
+    """
+    Async Ollama client shared by the whole app.
+    Keeps one keep-alive connection pool open, runs at most OLLAMA_MAX_CONCURRENCY
+    generations at a time and queues up to OLLAMA_MAX_QUEUE more behind them.
+    """
+    def __init__(self):
+        self.base_url = settings.OLLAMA_BASE_URL
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._waiting = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the server's event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                # The read timeout applies between chunks, not to the whole generation
+                timeout=httpx.Timeout(settings.OLLAMA_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=settings.OLLAMA_MAX_CONCURRENCY,
+                    max_keepalive_connections=settings.OLLAMA_MAX_CONCURRENCY,
+                    keepalive_expiry=300,
+                ),
+            )
+        return self._client
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.OLLAMA_MAX_CONCURRENCY)
+        return self._semaphore
+
+    @asynccontextmanager
+    async def _slot(self):
+        """Waits for a free generation slot, rejecting the request if the queue is full."""
+        semaphore = self._get_semaphore()
+        if not semaphore.locked():
+            # Free slot: acquire() returns without suspending
+            await semaphore.acquire()
+        else:
+            if self._waiting >= settings.OLLAMA_MAX_QUEUE:
+                raise LLMBusyError(f"{self._waiting} requests are already waiting for the AI model")
+
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(semaphore.acquire(), timeout=settings.OLLAMA_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise LLMBusyError(f"Waited {settings.OLLAMA_QUEUE_TIMEOUT}s for a free AI model slot")
+            finally:
+                self._waiting -= 1
+
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    async def generate(self, payload: dict) -> dict:
+        """Non-streaming /api/generate call. Returns Ollama's JSON reply."""
+        async with self._slot():
+            response = await self._get_client().post("/api/generate", json={**payload, "stream": False})
+            response.raise_for_status()
+            return response.json()
+
+    async def stream(self, payload: dict) -> AsyncIterator[dict]:
+        """Streaming /api/generate call. Yields each NDJSON chunk as Ollama produces it."""
+        async with self._slot():
+            async with self._get_client().stream("POST", "/api/generate", json={**payload, "stream": True}) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise RuntimeError(chunk["error"])
+                    yield chunk
+                    if chunk.get("done"):
+                        break
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+llm_client = OllamaClient()
@@ -1,4 +1,5 @@
 import io
+import re
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -7,6 +8,25 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, Tabl
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 from datetime import datetime
 
+# Meta tags and prefixes the LLM sometimes adds to question text, removed by clean_q_text
+_CLEANUP_PATTERNS = [
+    re.compile(r'^Unit\s*\d+\s*[:\-\.]\s*', re.IGNORECASE), # leading "Unit X -" or "Unit X:"
+    re.compile(r'\s*\(Unit:.*?\)', re.IGNORECASE), # trailing (Unit: unit 1, Part: part a)
+    re.compile(r'\s*\(Part:.*?\)', re.IGNORECASE),
+    re.compile(r'\s*\(CO\d+\)', re.IGNORECASE),
+    re.compile(r'\s*\(\w+\s*CO\d+\)', re.IGNORECASE), # (Un CO1), (Re CO2), (Ap CO4)
+    re.compile(r'\s*[\[\(]Unit\s*\d+[\]\)]', re.IGNORECASE), # (Unit 1), [Unit 2]
+    re.compile(r'^\d+[\.\)]\s*'), # leading numbering, e.g. "1. Question"
+]
+
+def clean_q_text(text: str) -> str:
+    """Question text without accidentally generated meta tags and prefixes."""
+    # Remove (2 marks), (16 marks)
+    text = text.replace("(2 marks)", "").replace("(16 marks)", "")
+    for pattern in _CLEANUP_PATTERNS:
+        text = pattern.sub('', text)
+    return text.strip()
+
 class PDFGenerator:
     def __init__(self):
         self.width, self.height = A4
@@ -138,25 +158,6 @@ class PDFGenerator:
         elements.append(q_header)
         elements.append(Spacer(1, 8))
 
-        # Helper to clean question text (remove accidentally generated meta tags and prefixes)
-        import re
-        def clean_q_text(text):
-            # Remove (2 marks), (16 marks)
-            text = text.replace("(2 marks)", "").replace("(16 marks)", "")
-            # Remove leading "Unit X -" or "Unit X:" prefix
-            text = re.sub(r'^Unit\s*\d+\s*[:\-\.]\s*', '', text, flags=re.IGNORECASE)
-            # Remove trailing metadata like (Unit: unit 1, Part: part a)
-            text = re.sub(r'\s*\(Unit:.*?\)', '', text, flags=re.IGNORECASE)
-            text = re.sub(r'\s*\(Part:.*?\)', '', text, flags=re.IGNORECASE)
-            text = re.sub(r'\s*\(CO\d+\)', '', text, flags=re.IGNORECASE)
-            # Remove (Un CO1), (Re CO2), (Ap CO4) patterns
-            text = re.sub(r'\s*\(\w+\s*CO\d+\)', '', text, flags=re.IGNORECASE)
-            # Remove (Unit 1), (Unit 2), [Unit 1], [Unit 2] patterns
-            text = re.sub(r'\s*[\[\(]Unit\s*\d+[\]\)]', '', text, flags=re.IGNORECASE)
-            # Remove leading numbering if captured (e.g. "1. Question")
-            text = re.sub(r'^\d+[\.\)]\s*', '', text)
-            return text.strip()
-
         # PART A
         elements.append(Paragraph("Part-A (Questions x 2 Marks)", self.section_header))
         elements.append(Spacer(1, 6))
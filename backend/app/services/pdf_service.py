@@ -1,57 +1,127 @@
 import fitz  # PyMuPDF
-from typing import List
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Iterator, List, Optional, Union
 import re
+from app.config import settings
+
+# Structural markers that tag the chunks that follow them
+UNIT_PATTERN = re.compile(r'\b(unit|module|chapter)\s*[:\.-]?\s*(\d+|[ivx]+)\b', re.IGNORECASE)
+PART_PATTERN = re.compile(r'\b(part|section)\s*[:\.-]?\s*([a-c])\b', re.IGNORECASE)
+CO_PATTERN = re.compile(r'\b(co)\s*[:\.-]?\s*(\d+)\b', re.IGNORECASE)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn, not fork: the server process has threads (ingestion workers, compaction)
+        _executor = ProcessPoolExecutor(max_workers=_worker_count(), mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+def _worker_count() -> int:
+    return settings.PDF_EXTRACT_WORKERS or os.cpu_count() or 1
+
+def _extract_range(file_path: str, start: int, stop: int) -> List[str]:
+    """Text of pages [start, stop). Runs in a worker process, which opens its own copy of the PDF."""
+    doc = fitz.open(file_path)
+    try:
+        return [doc[i].get_text("text") for i in range(start, stop)]
+    finally:
+        doc.close()
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
 
 class PDFService:
     @staticmethod
-    def extract_text(file_path: str) -> str:
+    def page_count(file_path: str) -> int:
         doc = fitz.open(file_path)
-        text = ""
-        for page in doc:
-            # Use block-based extraction to preserve some structure
-            text += page.get_text("text") + "\n\n---PAGE_BREAK---\n\n"
-        doc.close()
-        return text
+        try:
+            return doc.page_count
+        finally:
+            doc.close()
 
     @staticmethod
-    def split_text(text: str, chunk_size: int = 1500, overlap: int = 300) -> List[dict]:
+    def iter_pages(file_path: str) -> Iterator[str]:
+        """
+        Yields the text of every page, in order. PDFs with at least PDF_PARALLEL_MIN_PAGES
+        pages are split into contiguous page ranges that are extracted in a process pool;
+        only a few ranges per worker are in flight, so a slow consumer keeps memory flat.
+        """
+        page_count = PDFService.page_count(file_path)
+        workers = _worker_count()
+        if page_count < settings.PDF_PARALLEL_MIN_PAGES or workers < 2:
+            doc = fitz.open(file_path)
+            try:
+                for page in doc:
+                    yield page.get_text("text")
+            finally:
+                doc.close()
+            return
+
+        # A few ranges per worker so one slow (image-heavy) range does not hold up the rest
+        range_size = max(1, -(-page_count // (workers * 4)))
+        executor = _get_executor()
+        in_flight = deque()
+        try:
+            for start in range(0, page_count, range_size):
+                in_flight.append(executor.submit(_extract_range, file_path, start, min(start + range_size, page_count)))
+                if len(in_flight) >= workers * 2:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for the next document
+            shutdown_executor()
+            raise
+
+    @staticmethod
+    def split_text(pages: Union[Iterable[str], str], chunk_size: int = 1500, overlap: int = 300) -> List[dict]:
         """
         Splits text line-by-line to ensure structural metadata is captured precisely.
+        Takes the per-page texts from iter_pages (or a single string).
         """
-        lines = text.split('\n')
-        chunks = []
+        return list(PDFService.iter_chunks(pages, chunk_size, overlap))
+
+    @staticmethod
+    def iter_chunks(pages: Union[Iterable[str], str], chunk_size: int = 1500, overlap: int = 300) -> Iterator[Dict]:
+        """split_text as a generator: pages are consumed, and chunks yielded, one at a time."""
+        if isinstance(pages, str):
+            pages = [pages]
+        lines = (line for page in pages for line in page.split('\n'))
         
         current_unit = None
         current_part = None
         current_co = None
         
-        # Regex for Structural Markers (more robust patterns)
-        unit_pattern = re.compile(r'\b(unit|module|chapter)\s*[:\.-]?\s*(\d+|[ivx]+)\b', re.IGNORECASE)
-        part_pattern = re.compile(r'\b(part|section)\s*[:\.-]?\s*([a-c])\b', re.IGNORECASE)
-        co_pattern = re.compile(r'\b(co)\s*[:\.-]?\s*(\d+)\b', re.IGNORECASE)
-
         current_chunk_text = ""
 
         for line in lines:
             line = line.strip()
             if not line: continue
-            if "---PAGE_BREAK---" in line: continue
 
             # Detect Header Changes
-            u_match = unit_pattern.search(line)
-            p_match = part_pattern.search(line)
-            c_match = co_pattern.search(line)
+            u_match = UNIT_PATTERN.search(line)
+            p_match = PART_PATTERN.search(line)
+            c_match = CO_PATTERN.search(line)
 
             # If a major header change is found (Unit or Part), 
             # flush the current chunk so it's tagged with the OLD state.
             # But only if the chunk has enough text to be a real chunk.
             if (u_match or p_match) and len(current_chunk_text) > 100:
-                chunks.append({
+                yield {
                     "text": current_chunk_text.strip(),
                     "unit": current_unit,
                     "part": current_part,
                     "co": current_co
-                })
+                }
                 current_chunk_text = ""
 
             # Update State (ONLY IF MATCHED)
@@ -64,20 +134,18 @@ class PDFService:
 
             # Flush if chunk size exceeded
             if len(current_chunk_text) >= chunk_size:
-                chunks.append({
+                yield {
                     "text": current_chunk_text.strip(),
                     "unit": current_unit,
                     "part": current_part,
                     "co": current_co
-                })
+                }
                 current_chunk_text = ""
 
         if current_chunk_text.strip():
-            chunks.append({
+            yield {
                 "text": current_chunk_text.strip(),
                 "unit": current_unit,
                 "part": current_part,
                 "co": current_co
-            })
-            
-        return chunks
+            }
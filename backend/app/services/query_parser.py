@@ -0,0 +1,93 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# Numbers tied to unit keywords: "unit 2", "module 4", "units 1, 2 and 3", "unit iv"
+UNIT_PATTERN = re.compile(r'\b(?:unit|module|chapter|units|modules)\s*[:\.-]?\s*((?:\d+|[ivx]+)(?:\s*(?:and|,|&)\s*(?:\d+|[ivx]+))*)', re.IGNORECASE)
+UNIT_VALUE_PATTERN = re.compile(r'(\d+|[ivx]+)')
+# "CO1", "CO-2"
+CO_PATTERN = re.compile(r'\b(co)\s*[:\.-]?\s*(\d+)\b', re.IGNORECASE)
+# "Part A", "Section B"
+PART_PATTERN = re.compile(r'\b(part|section)\s*[:\.-]?\s*([a-c])\b', re.IGNORECASE)
+MARKS_PATTERN = re.compile(r'\b(\d+)\s*(marks|mark)\b', re.IGNORECASE)
+
+def _keywords(*words: str) -> "re.Pattern":
+    # Plain substring matching (no word boundaries), like `any(k in query.lower() ...)`
+    return re.compile("|".join(re.escape(word) for word in words))
+
+# Questions from every unit, mixed
+GLOBAL_MULTI_KEYWORDS = _keywords("all units", "mixed", "random", "across units", "from all", "all the unit", "different units")
+# Keep the vector ranking instead of shuffling ("toughest", "define", ...)
+DETERMINISTIC_KEYWORDS = _keywords("toughest", "hardest", "most difficult", "complex", "best", "top", "rank", "what is", "define", "explain")
+# New questions may be written, not just copied from the documents
+CREATIVE_KEYWORDS = _keywords("create", "generate", "invent", "analyze", "design", "make")
+
+# Marks that imply a part when none is named
+PART_BY_MARKS = {"2": "a", "16": "b"}
+
+@dataclass
+class QueryPlan:
+    """What a chat query asks for, and how RAGService should search for it."""
+    units: List[str] = field(default_factory=list) # "unit 1", "unit iv", ... in the order asked
+    part: Optional[str] = None # "a", "b" or "c"
+    co: Optional[str] = None # "co1", ...
+    marks: Optional[str] = None
+    global_multi: bool = False # "all units", "mixed", ...
+    creative: bool = False
+    deterministic: bool = False
+
+    @property
+    def stratify(self) -> bool:
+        """Search each unit separately and interleave the results."""
+        return self.global_multi or len(self.units) > 1
+
+    def search_query(self, query: str) -> str:
+        """The query with the detected unit and part appended, to pull the embedding towards them."""
+        if self.units:
+            query += f" {' '.join(self.units)}"
+        if self.part:
+            query += f" part {self.part}"
+        return query
+
+    def unit_filters(self, default_units: List[str]) -> Dict[str, Dict]:
+        """Per-unit metadata filters for a stratified search (default_units when none were named)."""
+        filters = {}
+        for unit in self.units or default_units:
+            unit_filter = {"unit": unit}
+            if self.part: unit_filter["part"] = f"part {self.part}"
+            if self.co: unit_filter["co"] = self.co
+            filters[unit] = unit_filter
+        return filters
+
+    def filter_dict(self) -> Dict[str, str]:
+        """Metadata filter for a single (non-stratified) search."""
+        filters = {}
+        if self.units: filters["unit"] = self.units[0]
+        if self.part: filters["part"] = f"part {self.part}"
+        if self.co: filters["co"] = self.co
+        if self.marks in PART_BY_MARKS and not self.part:
+            filters["part"] = f"part {PART_BY_MARKS[self.marks]}"
+        return filters
+
+def parse_query(query: str) -> QueryPlan:
+    lowered = query.lower()
+
+    units = []
+    unit_match = UNIT_PATTERN.search(query)
+    if unit_match:
+        # Deduplicated, in the order asked
+        units = list(dict.fromkeys(f"unit {v}" for v in UNIT_VALUE_PATTERN.findall(unit_match.group(1).lower())))
+
+    co_match = CO_PATTERN.search(query)
+    part_match = PART_PATTERN.search(query)
+    marks_match = MARKS_PATTERN.search(query)
+
+    return QueryPlan(
+        units=units,
+        part=part_match.group(2).lower() if part_match else None,
+        co=f"co{co_match.group(2)}" if co_match else None,
+        marks=marks_match.group(1) if marks_match else None,
+        global_multi=GLOBAL_MULTI_KEYWORDS.search(lowered) is not None,
+        creative=CREATIVE_KEYWORDS.search(lowered) is not None,
+        deterministic=DETERMINISTIC_KEYWORDS.search(lowered) is not None,
+    )
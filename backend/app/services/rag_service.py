@@ -1,56 +1,167 @@
+import asyncio
 import logging
 import re
-import requests
-import json
-import time
 import random
+import httpx
 from typing import List, Dict, Optional
 from app.config import settings
+from app.services.llm_client import llm_client, LLMBusyError
 from app.services.vector_store import vector_store
+from app.services.query_parser import parse_query
+from app.services.context_packer import estimate_tokens, format_chunk, pack_context
+from app.services.json_stream import JSONItemStream
 
 logger = logging.getLogger(__name__)
 
+NO_CONTEXT_ANSWER = "❌ **No relevant questions found.**\n\nI couldn't find any questions matching your request in the provided documents."
+
+THINK_OPEN, THINK_CLOSE = "<think>", "</think>"
+THINK_BLOCK_PATTERN = re.compile(r'<think>.*?</think>', re.DOTALL)
+
+def _partial_tag_len(text: str, tag: str) -> int:
+    """Length of the longest prefix of `tag` that `text` ends with."""
+    for n in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:n]):
+            return n
+    return 0
+
+async def strip_think_stream(tokens):
+    """
+    Streaming counterpart of the <think>...</think> cleanup done in _query_llm.
+    Closing it closes `tokens` too, so the Ollama stream behind it is released.
+    """
+    buffer = ""
+    in_think = False
+    try:
+        async for token in tokens:
+            buffer += token
+            while buffer:
+                if in_think:
+                    end = buffer.find(THINK_CLOSE)
+                    if end == -1:
+                        # Keep only what could still be the start of a closing tag
+                        buffer = buffer[len(buffer) - _partial_tag_len(buffer, THINK_CLOSE):]
+                        break
+                    buffer = buffer[end + len(THINK_CLOSE):].lstrip()
+                    in_think = False
+                else:
+                    start = buffer.find(THINK_OPEN)
+                    if start == -1:
+                        safe = len(buffer) - _partial_tag_len(buffer, THINK_OPEN)
+                        if safe:
+                            yield buffer[:safe]
+                            buffer = buffer[safe:]
+                        break
+                    if start:
+                        yield buffer[:start]
+                    buffer = buffer[start + len(THINK_OPEN):]
+                    in_think = True
+        if buffer and not in_think:
+            yield buffer
+    finally:
+        await tokens.aclose()
+
+def format_history(history: List[dict], budget: int) -> str:
+    """
+    Earlier turns as a transcript for the prompt, newest kept first: older messages are
+    dropped once `budget` tokens are used, and a message that doesn't fit is cut short.
+    """
+    lines = []
+    remaining = budget
+    for message in reversed(history):
+        if remaining <= 0:
+            break
+        speaker = "User" if message["role"] == "user" else "Assistant"
+        content = message["content"].strip()
+        if estimate_tokens(content) > remaining:
+            content = content[:remaining * 4].rstrip() + " ..."
+        lines.append(f"{speaker}: {content}")
+        remaining -= estimate_tokens(lines[-1])
+    return "\n\n".join(reversed(lines))
+
+# Questions each unit contributes to a generated paper
+EXAM_PART_A_PER_UNIT = 2
+EXAM_PART_B_PER_UNIT = 1
+EXAM_COGNITIVE_LEVELS = {"Re", "Un", "Ap", "An", "Ev", "Cr"}
+
+# Part of a unit's piece -> questions it contributes, and the cognitive level used when the model gives none
+EXAM_PARTS = {"part_a": (EXAM_PART_A_PER_UNIT, "Re"), "part_b": (EXAM_PART_B_PER_UNIT, "Ap")}
+
+class ExamPieceError(Exception):
+    """Raised when a per-unit exam generation returns too few usable questions."""
+    pass
+
+def _exam_schema(counts: Dict[str, int]) -> dict:
+    """JSON schema for Ollama's structured output: exactly counts[part] questions per part."""
+    question = {
+        "type": "object",
+        "properties": {
+            "question": {"type": "string"},
+            "cl": {"type": "string", "enum": sorted(EXAM_COGNITIVE_LEVELS)},
+            "co": {"type": "string"},
+        },
+        "required": ["question", "cl", "co"],
+    }
+    return {
+        "type": "object",
+        "properties": {
+            part: {"type": "array", "items": question, "minItems": count, "maxItems": count}
+            for part, count in counts.items()
+        },
+        "required": list(counts),
+    }
+
+def _valid_question(item, co: str, default_cl: str) -> Optional[dict]:
+    """A generated question tagged with the unit's CO, or None if it has no text."""
+    if not isinstance(item, dict) or not str(item.get("question") or "").strip():
+        return None
+    cl = item.get("cl") if item.get("cl") in EXAM_COGNITIVE_LEVELS else default_cl
+    return {"question": str(item["question"]).strip(), "cl": cl, "co": co}
+
 class RAGService:
     def __init__(self):
-        self.ollama_url = f"{settings.OLLAMA_BASE_URL}/api/generate"
         self.model = settings.OLLAMA_MODEL
 
-    def _query_llm(self, prompt: str, system_prompt: str = "") -> str:
-        payload = {
+    def _payload(self, prompt: str, system_prompt: str = "") -> dict:
+        return {
             "model": self.model,
             "prompt": prompt,
             "system": system_prompt,
-            "stream": False,
             "options": {
                 "temperature": 0.4, # Increased for better variety
                 "top_p": 0.9,
             }
         }
+
+    async def _query_llm(self, prompt: str, system_prompt: str = "") -> str:
+        payload = self._payload(prompt, system_prompt)
         
         retries = 2
         retry_delay = 2 # seconds
         
         for attempt in range(retries):
             try:
-                # Increased timeout to 120s for complex multi-unit queries
-                response = requests.post(self.ollama_url, json=payload, timeout=120)
-                response.raise_for_status()
-                result = response.json().get("response", "")
+                # Timeout (OLLAMA_TIMEOUT, 120s by default) allows for complex multi-unit queries
+                result = (await llm_client.generate(payload)).get("response", "")
                 
                 # Clean up <think> tags if present
-                result = re.sub(r'<think>.*?</think>', '', result, flags=re.DOTALL).strip()
+                result = THINK_BLOCK_PATTERN.sub('', result).strip()
                 return str(result)
                 
-            except requests.exceptions.ConnectionError:
+            except httpx.ConnectError:
                 logger.error("Cannot connect to Ollama. Make sure Ollama is running.")
                 return "I apologize, but I cannot connect to the local AI service. Please ensure Ollama is running."
                 
-            except requests.exceptions.Timeout:
+            except httpx.TimeoutException:
                 logger.warning(f"Ollama request timed out (Attempt {attempt+1}/{retries})")
                 if attempt < retries - 1:
-                    time.sleep(retry_delay)
+                    await asyncio.sleep(retry_delay)
                     continue
                 return "The AI model is taking quite a while to process this complex request. Please try refreshing in a moment; the answer should appear in your history!"
+
+            except LLMBusyError as e:
+                logger.warning(f"Ollama queue full: {e}")
+                return "The AI service is busy answering other requests right now. Please try again in a minute."
                 
             except Exception as e:
                 logger.error(f"LLM Query failed: {e}")
@@ -58,63 +169,59 @@ class RAGService:
         
         return "The AI service is currently unavailable. Please try again."
 
-    def generate_response(self, subject_id: int, query: str, history: List[dict] = []) -> dict:
-        # 1. Precise Intent and Filter Detection
-        # Look for numbers specifically tied to unit keywords: "unit 2", "module 4", "units 1, 2, 3"
-        unit_keyword_pattern = r'\b(?:unit|module|chapter|units|modules)\s*[:\.-]?\s*((?:\d+|[ivx]+)(?:\s*(?:and|,|&)\s*(?:\d+|[ivx]+))*)'
-        unit_match = re.search(unit_keyword_pattern, query, re.IGNORECASE)
-        
-        target_units = []
-        if unit_match:
-            # Extract all digit/roman sequences from the captured list
-            raw_vals = re.findall(r'(\d+|[ivx]+)', unit_match.group(1).lower())
-            target_units = [f"unit {v}" for v in raw_vals]
-            
-        # Deduplicate while preserving order
-        target_units = list(dict.fromkeys(target_units))
-        
-        # Look for CO mentions (e.g., "CO1", "CO-2")
-        co_match = re.search(r'\b(co)\s*[:\.-]?\s*(\d+)\b', query, re.IGNORECASE)
-        target_co = f"co{co_match.group(2)}" if co_match else None
-        
-        # Look for section/part mentions (e.g., "Part A", "Section B")
-        part_match = re.search(r'\b(part|section)\s*[:\.-]?\s*([a-c])\b', query, re.IGNORECASE)
-        target_part = part_match.group(2).lower() if part_match else None
-        
-        # Look for mark mentions
-        marks_match = re.search(r'\b(\d+)\s*(marks|mark)\b', query, re.IGNORECASE)
-        target_marks = marks_match.group(1) if marks_match else None
-        
-        # Check for global multi-unit intent
-        is_global_multi = any(k in query.lower() for k in ["all units", "mixed", "random", "across units", "from all", "all the unit", "different units"])
-        
-        should_stratify = is_global_multi or len(target_units) > 1
-        
-        # Enhance query
-        search_query = query
-        if target_units: search_query += f" {' '.join(target_units)}"
-        if target_part: search_query += f" part {target_part}"
+    def _stream_llm(self, prompt: str, system_prompt: str = ""):
+        """Yields response tokens from Ollama's streaming (NDJSON) API as they are generated."""
+        payload = self._payload(prompt, system_prompt)
+
+        async def raw_tokens():
+            try:
+                async for chunk in llm_client.stream(payload):
+                    if chunk.get("response"):
+                        yield chunk["response"]
+
+            except httpx.ConnectError:
+                logger.error("Cannot connect to Ollama. Make sure Ollama is running.")
+                yield "I apologize, but I cannot connect to the local AI service. Please ensure Ollama is running."
+
+            except httpx.TimeoutException:
+                logger.warning("Ollama streaming request timed out")
+                yield "\n\nThe AI model stopped responding. Please try again in a moment."
+
+            except LLMBusyError as e:
+                logger.warning(f"Ollama queue full: {e}")
+                yield "The AI service is busy answering other requests right now. Please try again in a minute."
+
+            except Exception as e:
+                logger.error(f"LLM stream failed: {e}")
+                yield f"I apologize, but I encountered an error: {str(e)}"
+
+        return strip_think_stream(raw_tokens())
+
+    def _prepare_response(self, subject_id: int, query: str, history: List[dict] = []) -> dict:
+        """
+        Runs intent detection and retrieval, and builds the prompts for a chat turn.
+        Returns a ready-made "answer" instead of prompts when no context was found.
+        """
+        # 1. Intent and filter detection (units, part, CO, marks, mode)
+        plan = parse_query(query)
+        search_query = plan.search_query(query)
 
         # 2. Balanced Vector Search (Context Interleaving)
         try:
-            if should_stratify:
-                logger.info(f"Balanced stratified search: {target_units if target_units else 'all'}")
-                unit_pools = {}
-                units_to_search = target_units if target_units else [f"unit {i}" for i in range(1, 6)]
-                
-                for unit_tag in units_to_search:
-                    unit_filter = {"unit": unit_tag}
-                    if target_part: unit_filter["part"] = f"part {target_part}"
-                    if target_co: unit_filter["co"] = target_co
-                    
-                    unit_docs = vector_store.search(
-                        subject_id=subject_id, 
-                        query=search_query, 
-                        k=15, # Larger pool for variety
-                        filter_dict=unit_filter
-                    )
+            if plan.stratify:
+                logger.info(f"Balanced stratified search: {plan.units if plan.units else 'all'}")
+                unit_filters = plan.unit_filters(default_units=[f"unit {i}" for i in range(1, 6)])
+                units_to_search = list(unit_filters)
+
+                # One embedding + one FAISS search for all units
+                unit_pools = vector_store.search_multi(
+                    subject_id=subject_id,
+                    query=search_query,
+                    filters=unit_filters,
+                    k=15 # Larger pool for variety
+                )
+                for unit_docs in unit_pools.values():
                     random.shuffle(unit_docs) # Shuffle each unit pool
-                    unit_pools[unit_tag] = unit_docs
 
                 # INTERLEAVE: Take Doc 1 from Unit A, Doc 1 from Unit B, etc.
                 # This ensures the LLM attention is forced to see all requested units evenly.
@@ -125,36 +232,21 @@ class RAGService:
                         if i < len(unit_pools.get(unit_tag, [])):
                             interleaved_docs.append(unit_pools[unit_tag][i])
                 
-                docs = interleaved_docs if interleaved_docs else vector_store.search(subject_id, search_query, k=25)
+                docs = interleaved_docs if interleaved_docs else vector_store.search(subject_id, search_query, k=settings.CHAT_RETRIEVAL_K)
             else:
                 # Normal filtering logic (Single Unit)
-                filter_dict = {}
-                if target_units: filter_dict["unit"] = target_units[0]
-                if target_part: filter_dict["part"] = f"part {target_part}"
-                if target_co: filter_dict["co"] = target_co
-                
-                if target_marks and not target_part:
-                    if target_marks == "2": filter_dict["part"] = "part a"
-                    elif target_marks == "16": filter_dict["part"] = "part b"
-
-                # Deterministic check for "best/toughest" questions
-                needs_determinism = any(k in query.lower() for k in ["toughest", "hardest", "most difficult", "complex", "best", "top", "rank", "what is", "define", "explain"])
-                
-                docs = vector_store.search(subject_id, search_query, k=25, filter_dict=filter_dict if filter_dict else None)
+                filter_dict = plan.filter_dict()
+                docs = vector_store.search(subject_id, search_query, k=settings.CHAT_RETRIEVAL_K, filter_dict=filter_dict if filter_dict else None)
                 
-                if not needs_determinism:
+                # "best/toughest" questions keep the vector rank order
+                if not plan.deterministic:
                     random.shuffle(docs)
                 else:
                     logger.info("Deterministic mode enabled: Preserving vector rank order.")
 
-            # Format context
-            context_parts = []
-            for d in docs:
-                meta = d.get("metadata", {})
-                source_info = f"[Source: {meta.get('filename', 'Unknown')} | Unit: {meta.get('unit', 'N/A')} | Part: {meta.get('part', 'N/A')}]"
-                context_parts.append(f"{source_info}\n{d['text']}")
-            
-            context_text = "\n\n---\n\n".join(context_parts)
+            # Fit the context into the token budget: no near-duplicates, every unit keeps a share
+            docs = pack_context(docs, settings.CONTEXT_TOKEN_BUDGET)
+            context_text = "\n\n---\n\n".join(format_chunk(d) for d in docs)
         except Exception as e:
             logger.error(f"Vector search failed: {e}")
             docs = []
@@ -162,19 +254,17 @@ class RAGService:
         
         if not context_text:
             return {
-                "answer": "❌ **No relevant questions found.**\n\nI couldn't find any questions matching your request in the provided documents.",
+                "answer": NO_CONTEXT_ANSWER,
                 "context_used": []
             }
 
         # 3. Construct System Prompt with BALANCE & GROUNDING RULES
-        is_creative = any(k in query.lower() for k in ["create", "generate", "invent", "analyze", "design", "make"])
-
         system_rules = [
             "You are 'ExamGen AI', a helpful and intelligent university exam assistant.",
             "Your main goal is to extract or generate questions based on the provided documents.",
         ]
         
-        if is_creative:
+        if plan.creative:
             system_rules.extend([
                 "MODE: CREATIVE / GENERATIVE",
                 "1. Analyze the provided context and synthesized NEW questions.",
@@ -196,92 +286,209 @@ class RAGService:
         ]
         system_rules.extend(common_rules)
         
-        if target_units:
-            units_str = " and ".join([u.upper() for u in target_units])
+        if plan.units:
+            units_str = " and ".join([u.upper() for u in plan.units])
             system_rules.append(f"Focus specifically on providing questions from {units_str}.")
-        if target_part:
-            system_rules.append(f"Search only for {target_part.upper()} questions.")
+        if plan.part:
+            system_rules.append(f"Search only for {plan.part.upper()} questions.")
         
         system_prompt = "\n".join(system_rules)
 
-        # 4. Generate Response
         prompt = f"Context from uploaded documents:\n{context_text}\n\nUser Question: {query}\n\nResponse (balanced list):"
-        answer = self._query_llm(prompt, system_prompt)
+        # Earlier turns, so follow-ups like "give me 5 more" or "explain the second one" work
+        conversation = format_history(history, settings.CHAT_HISTORY_TOKEN_BUDGET)
+        if conversation:
+            prompt = f"Conversation so far:\n{conversation}\n\n{prompt}"
 
         return {
-            "answer": answer,
+            "prompt": prompt,
+            "system_prompt": system_prompt,
             "context_used": docs
         }
 
-    def generate_structured_exam(self, subject_id: int, unit_count: int = 5) -> dict:
+    async def generate_response(self, subject_id: int, query: str, history: List[dict] = []) -> dict:
+        # Retrieval is CPU-bound (embedding + FAISS), so keep it off the event loop
+        prepared = await asyncio.to_thread(self._prepare_response, subject_id, query, history)
+        if "answer" in prepared:
+            return prepared
+
+        # 4. Generate Response
+        answer = await self._query_llm(prepared["prompt"], prepared["system_prompt"])
+
+        return {
+            "answer": answer,
+            "context_used": prepared["context_used"]
+        }
+
+    async def stream_response(self, subject_id: int, query: str, history: List[dict] = []) -> dict:
+        """
+        Same as generate_response, but "tokens" is an async generator that yields the answer
+        piece by piece as Ollama produces it.
+        """
+        prepared = await asyncio.to_thread(self._prepare_response, subject_id, query, history)
+        if "answer" in prepared:
+            async def fixed_answer():
+                yield prepared["answer"]
+            return {
+                "tokens": fixed_answer(),
+                "context_used": prepared["context_used"]
+            }
+
+        return {
+            "tokens": self._stream_llm(prepared["prompt"], prepared["system_prompt"]),
+            "context_used": prepared["context_used"]
+        }
+
+    async def generate_structured_exam(self, subject_id: int, unit_count: int = 5) -> dict:
         """
         Generates a full exam paper structure with Part A (2 marks) and Part B (16 marks).
         Strictly enforces the St. Xavier's format with CL and CO mapping.
+
+        Every unit is a separate, small generation (2 Part A + 1 Part B questions from that
+        unit's notes), EXAM_CONCURRENCY at a time; the pieces are merged in unit order.
+        A piece that fails or comes back incomplete is retried on its own, for the missing
+        questions only. Units that still fail are listed in "errors".
         """
-        
-        # 1. Define the System Prompt for JSON Structure
-        system_prompt = """
+        units = [f"unit {i}" for i in range(1, unit_count + 1)]
+
+        # 1. Retrieve context for all units at once, plus an unfiltered pool from the whole
+        # subject for units without tagged chunks (e.g. notes without "Unit N" headings)
+        filters = {unit: {"unit": unit} for unit in units}
+        filters["_all"] = None
+        pools = await asyncio.to_thread(
+            vector_store.search_multi, subject_id, "important questions definitions", filters, 8
+        )
+        unit_docs = [pools[unit] or pools["_all"] for unit in units]
+
+        # 2. Generate the units that have material concurrently. A unit that raises only fails itself
+        semaphore = asyncio.Semaphore(settings.EXAM_CONCURRENCY)
+        numbers = [number for number, docs in enumerate(unit_docs, start=1) if docs]
+        results = await asyncio.gather(*(
+            self._generate_exam_unit(number, unit_docs[number - 1], semaphore) for number in numbers
+        ), return_exceptions=True)
+        pieces = dict(zip(numbers, results))
+
+        # 3. Merge. Failed units are reported in "errors", never as questions
+        exam = {"part_a": [], "part_b": [], "errors": []}
+        for number in range(1, unit_count + 1):
+            if number not in pieces:
+                exam["errors"].append(f"No notes found for Unit {number}.")
+                continue
+            piece = pieces[number]
+            if isinstance(piece, BaseException):
+                logger.error(f"Exam unit {number} failed: {piece!r}")
+                piece = None
+            if piece is None:
+                exam["errors"].append(f"Could not generate questions for Unit {number}.")
+                continue
+            missing = [part for part, (count, _) in EXAM_PARTS.items() if len(piece[part]) < count]
+            if missing:
+                exam["errors"].append(f"Could not generate all questions for Unit {number} ({', '.join(missing)}).")
+            exam["part_a"].extend(piece["part_a"])
+            exam["part_b"].extend(piece["part_b"])
+        return exam
+
+    async def _generate_exam_unit(self, number: int, docs: List[Dict], semaphore: asyncio.Semaphore) -> Optional[dict]:
+        """
+        One unit's share of the paper, validated; None if no question could be generated.
+
+        The reply is constrained to JSON (EXAM_OUTPUT_FORMAT) and parsed while it streams,
+        so questions completed before a timeout or a malformed tail are kept and a retry
+        only asks for the ones still missing.
+        """
+        co = f"CO{number}"
+
+        # Shuffle context for variety, then fit it into the per-unit budget
+        docs = random.sample(docs, len(docs))
+        docs = pack_context(docs, settings.EXAM_UNIT_CONTEXT_TOKENS, render=lambda d: d['text'])
+        context_text = "\n".join([d['text'] for d in docs])
+
+        piece = {part: [] for part in EXAM_PARTS}
+        attempts = settings.EXAM_PIECE_RETRIES + 1
+        for attempt in range(1, attempts + 1):
+            missing = {part: count - len(piece[part]) for part, (count, _) in EXAM_PARTS.items()}
+            system_prompt = f"""
         You are an expert exam setter for St. Xavier's Catholic College of Engineering.
-        Your task is to generate a question paper in strict JSON format.
+        Your task is to write the Unit {number} questions of a question paper in strict JSON format.
         
         STRUCTURE REQUIRED:
-        {
+        {{
             "part_a": [
-                {"question": "Define...", "cl": "Re", "co": "CO1"},
-                {"question": "What is...", "cl": "Un", "co": "CO1"}
-                ... (10 questions total, 2 from each Unit 1-5)
+                {{"question": "Define...", "cl": "Re", "co": "{co}"}},
+                {{"question": "What is...", "cl": "Un", "co": "{co}"}}
             ],
             "part_b": [
-                {"question": "Explain detailed...", "cl": "Ap", "co": "CO2"},
-                ... (5 questions total, 1 from each Unit 1-5)
+                {{"question": "Explain detailed...", "cl": "Ap", "co": "{co}"}}
             ]
-        }
+        }}
         
         RULES:
-        1. "part_a": Generate 10 questions (2 Marks). MUST cover all units equally.
-        2. "part_b": Generate 5 detailed questions (16 Marks). MUST cover all units.
+        1. "part_a": Generate exactly {missing["part_a"]} questions (2 Marks) from Unit {number}.
+        2. "part_b": Generate exactly {missing["part_b"]} detailed questions (16 Marks) from Unit {number}.
         3. "cl": Cognitive Level (Re=Remember, Un=Understand, Ap=Apply, An=Analyze, Ev=Evaluate, Cr=Create).
-        4. "co": Course Outcome (CO1, CO2, CO3, CO4, CO5). Map Unit 1->CO1, Unit 2->CO2, etc.
+        4. "co": always "{co}".
         5. OUTPUT JSON ONLY. No markdown, no conversational text.
         """
-        
-        # 2. Retrieve Context (Global Search)
-        # We need a broad context covering all units to ensure the LLM has material.
-        # Stratified search for all 5 units.
-        all_docs = []
-        for i in range(1, 6):
-            unit_docs = vector_store.search(subject_id, f"unit {i} important questions definitions", k=5, filter_dict={"unit": f"unit {i}"})
-            all_docs.extend(unit_docs)
-        
-        # Shuffle context for variety
-        random.shuffle(all_docs)
-        
-        # Limit context size to avoid context window overflow (top 20 chunks)
-        context_text = "\n".join([d['text'] for d in all_docs[:25]])
-        
-        prompt = f"""
-        Context from Course Notes:
+
+            written = [q["question"] for questions in piece.values() for q in questions]
+            already_written = ""
+            if written:
+                already_written = "Already written (do not repeat these):\n" + "\n".join(f"- {q}" for q in written)
+
+            prompt = f"""
+        Context from Course Notes (Unit {number}):
         {context_text}
         
         TASK:
-        Generate a full internal exam question paper based on the above context.
+        Generate the Unit {number} questions of an internal exam paper based on the above context.
         Follow the JSON structure strictly.
+        {already_written}
         """
-        
-        # 3. Query LLM
-        response_json_str = self._query_llm(prompt, system_prompt)
-        
-        # 4. Parse JSON
-        try:
-            # Clean potential markdown wrappers
-            clean_json = re.sub(r'```json\s*|\s*```', '', response_json_str).strip()
-            data = json.loads(clean_json)
-            return data
-        except json.JSONDecodeError:
-            logger.error(f"Failed to parse Exam JSON: {response_json_str}")
-            return {
-                "part_a": [{"question": "Error generating exam. Please try again.", "cl": "N/A", "co": "N/A"}],
-                "part_b": []
-            }
+
+            payload = self._payload(prompt, system_prompt)
+            if settings.EXAM_OUTPUT_FORMAT == "schema":
+                payload["format"] = _exam_schema(missing)
+            elif settings.EXAM_OUTPUT_FORMAT == "json":
+                payload["format"] = "json"
+
+            parser = JSONItemStream()
+            try:
+                # The slot is only held while generating, not while waiting to retry
+                async with semaphore:
+                    tokens = strip_think_stream(
+                        chunk.get("response", "") async for chunk in llm_client.stream(payload)
+                    )
+                    try:
+                        async for token in tokens:
+                            for part, item in parser.feed(token):
+                                if part not in EXAM_PARTS or len(piece[part]) == EXAM_PARTS[part][0]:
+                                    continue
+                                question = _valid_question(item, co, default_cl=EXAM_PARTS[part][1])
+                                if question and question["question"] not in written:
+                                    piece[part].append(question)
+                                    written.append(question["question"])
+                            if all(len(piece[part]) == count for part, (count, _) in EXAM_PARTS.items()):
+                                # Everything needed has arrived; stop the generation
+                                return piece
+                    finally:
+                        await tokens.aclose()
+                if not parser.started:
+                    raise ExamPieceError("no JSON object in the reply")
+                got = ", ".join(f"{len(piece[part])}/{count} {part}" for part, (count, _) in EXAM_PARTS.items())
+                raise ExamPieceError(f"got {got}" + ("" if parser.complete else " (reply cut off)"))
+            except httpx.ConnectError:
+                logger.error("Cannot connect to Ollama. Make sure Ollama is running.")
+                break
+            # Any transport or protocol error (timeouts, cut streams, bad status), an unreadable
+            # NDJSON line (ValueError) or an error chunk from Ollama (RuntimeError) costs one attempt
+            except (httpx.HTTPError, ValueError, LLMBusyError, RuntimeError, ExamPieceError) as e:
+                logger.warning(f"Exam unit {number} failed (attempt {attempt}/{attempts}): {type(e).__name__}: {e}")
+                if attempt < attempts:
+                    await asyncio.sleep(2)
+
+        if any(piece.values()):
+            logger.warning(f"Exam unit {number} is incomplete after {attempts} attempts")
+            return piece
+        return None
 
 rag_service = RAGService()
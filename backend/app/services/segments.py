@@ -0,0 +1,229 @@
+import json
+import os
+import faiss
+import numpy as np
+from typing import Callable, Dict, Optional, Set, Tuple
+from app.config import settings
+from app.services import index_factory
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+def _fsync(path: str):
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+def atomic_write_index(index: faiss.Index, path: str):
+    """Writes an index so that `path` is either absent or complete, never torn."""
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    _fsync(tmp_path)
+    os.replace(tmp_path, path)
+
+def atomic_write_json(data: dict, path: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class Segment:
+    """
+    One immutable index file. Delta segments also remember their ids for reconstruct().
+    `nbytes` is the heap memory it holds: its file size, or 0 when the file is memory-mapped.
+    """
+    __slots__ = ("name", "index", "ids", "nbytes")
+
+    def __init__(self, name: str, index: faiss.Index, ids: Optional[Set[int]] = None, nbytes: int = 0):
+        self.name = name
+        self.index = index
+        self.ids = ids
+        self.nbytes = nbytes
+
+class SegmentedIndex:
+    """
+    A subject's vectors as one base segment plus a few small append-only delta segments.
+
+    Segment files are never modified: every change writes new files and then swaps
+    manifest.json (write-to-temp + os.replace), which is the single commit point that moves
+    all segments together. Uploads only write a delta segment (bounded by
+    VECTOR_DELTA_MAX_CHUNKS); merge() folds the deltas into a new base in the background.
+    Readers take a snapshot of the segment tuple, so they never see a half-applied change.
+    """
+    def __init__(self, directory: str, dimension: int):
+        self.directory = directory
+        self.dimension = dimension
+        self.generation = 0
+        self.segments: Tuple[Segment, ...] = () # base first, then deltas oldest to newest
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    @classmethod
+    def create(cls, directory: str, dimension: int, base_index: Optional[faiss.Index] = None) -> "SegmentedIndex":
+        os.makedirs(directory, exist_ok=True)
+        segmented = cls(directory, dimension)
+        base = base_index if base_index is not None else index_factory.new_index("flat", dimension)
+        segmented._commit((segmented._write_segment("base", base),))
+        return segmented
+
+    @classmethod
+    def open(cls, directory: str, dimension: int, mmap_base: bool = False) -> "SegmentedIndex":
+        """
+        Loads the segments named in the manifest. With `mmap_base` a flat base segment is
+        memory-mapped instead of read, leaving its pages to the OS page cache; that is safe
+        because segment files are never modified (merge() clones the base before changing it).
+        HNSW and IVF-PQ bases are still read into memory (their graph and inverted lists
+        can't be mapped), so they count at their full size.
+        """
+        segmented = cls(directory, dimension)
+        with open(segmented.manifest_path) as f:
+            manifest = json.load(f)
+        segmented.generation = manifest["generation"]
+        segments = []
+        for entry in manifest["segments"]:
+            path = os.path.join(directory, entry["name"])
+            if mmap_base and entry["kind"] == "base":
+                index = faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC)
+                mapped = index_factory.index_kind(index) == "flat"
+            else:
+                index = faiss.read_index(path)
+                mapped = False
+            ids = None
+            if entry["kind"] == "delta":
+                ids = {int(i) for i in faiss.vector_to_array(index.id_map)}
+            segments.append(Segment(entry["name"], index, ids, 0 if mapped else os.path.getsize(path)))
+        segmented.segments = tuple(segments)
+        return segmented
+
+    @property
+    def base(self) -> faiss.Index:
+        return self.segments[0].index
+
+    @property
+    def deltas(self) -> Tuple[Segment, ...]:
+        return self.segments[1:]
+
+    @property
+    def kind(self) -> str:
+        return index_factory.index_kind(self.base)
+
+    @property
+    def ntotal(self) -> int:
+        return sum(segment.index.ntotal for segment in self.segments)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(segment.nbytes for segment in self.segments)
+
+    def _write_segment(self, kind: str, index: faiss.Index, ids: Optional[Set[int]] = None) -> Segment:
+        name = f"{kind}_{self.generation + 1:08d}.index"
+        path = os.path.join(self.directory, name)
+        atomic_write_index(index, path)
+        return Segment(name, index, ids, os.path.getsize(path))
+
+    def _commit(self, segments: Tuple[Segment, ...]):
+        manifest = {
+            "generation": self.generation + 1,
+            "segments": [{"name": s.name, "kind": "base" if i == 0 else "delta"} for i, s in enumerate(segments)],
+        }
+        atomic_write_json(manifest, self.manifest_path)
+        self.generation += 1
+        self.segments = segments
+        self._remove_unreferenced()
+
+    def _remove_unreferenced(self):
+        live = {segment.name for segment in self.segments} | {MANIFEST_NAME}
+        for filename in os.listdir(self.directory):
+            if filename not in live and filename.endswith(".index"):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError as e:
+                    logger.warning(f"Could not remove old segment {filename}: {e}")
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray):
+        """Appends vectors to the newest delta segment, or starts a new one if it is full."""
+        segments = list(self.segments)
+        last = segments[-1] if len(segments) > 1 else None
+        if last is not None and last.index.ntotal + len(ids) <= settings.VECTOR_DELTA_MAX_CHUNKS:
+            segments.pop()
+            delta = faiss.clone_index(last.index)
+            delta_ids = set(last.ids)
+        else:
+            delta = index_factory.new_index("flat", self.dimension)
+            delta_ids = set()
+        delta.add_with_ids(vectors, ids)
+        delta_ids.update(int(i) for i in ids)
+        segments.append(self._write_segment("delta", delta, delta_ids))
+        self._commit(tuple(segments))
+
+    def bump(self):
+        """Commits the current segments under a new generation, so other processes reload."""
+        self._commit(self.segments)
+
+    def search(self, query_np: np.ndarray, k: int, sel: Optional[faiss.IDSelector] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Searches every segment and merges the hits by distance, in index.search's shape."""
+        all_distances, all_ids = [], []
+        for segment in self.segments:
+            index = segment.index
+            if index.ntotal == 0:
+                continue
+            segment_k = min(k, index.ntotal)
+            distances, ids = index.search(query_np, segment_k, params=index_factory.search_params(index, segment_k, sel))
+            found = ids[0] != -1
+            all_distances.append(distances[0][found])
+            all_ids.append(ids[0][found])
+
+        if not all_ids:
+            return np.zeros((1, 0), dtype='float32'), np.zeros((1, 0), dtype='int64')
+        distances = np.concatenate(all_distances)
+        ids = np.concatenate(all_ids)
+        order = np.argsort(distances, kind="stable")[:k]
+        return distances[order][None, :], ids[order][None, :]
+
+    def reconstruct(self, ids: np.ndarray) -> np.ndarray:
+        """Stored vectors for the given ids, looked up in whichever segment holds them."""
+        vectors = np.zeros((len(ids), self.dimension), dtype='float32')
+        for row, chunk_id in enumerate(ids):
+            chunk_id = int(chunk_id)
+            segment = next((s for s in reversed(self.deltas) if chunk_id in s.ids), self.segments[0])
+            vectors[row] = segment.index.reconstruct(chunk_id)
+        return vectors
+
+    def merge(self, dead_ids: Set[int], target: str, live_ids: np.ndarray,
+              exact_vectors: Optional[Callable[[np.ndarray], Dict[int, np.ndarray]]] = None):
+        """
+        Folds all delta segments into a new base segment without the dead ids, switching the
+        base to the `target` tier if needed (which rebuilds it from the live vectors).
+
+        An IVF-PQ base only holds compressed vectors, so a rebuild from it takes the base's
+        vectors from `exact_vectors(ids)` (id -> vector) where it provides them; otherwise
+        the approximate reconstructions would be kept for good, even in the exact flat tier.
+        """
+        delta_ids = set().union(*(s.ids for s in self.deltas)) if self.deltas else set()
+        dead_in_base = dead_ids - delta_ids
+        if target != self.kind or (dead_in_base and not index_factory.supports_removal(self.base)):
+            vectors = self.reconstruct(live_ids)
+            if exact_vectors is not None and self.kind == "ivfpq":
+                rows = [row for row, chunk_id in enumerate(live_ids) if int(chunk_id) not in delta_ids]
+                exact = exact_vectors(live_ids[rows]) if rows else {}
+                for row in rows:
+                    vector = exact.get(int(live_ids[row]))
+                    if vector is not None:
+                        vectors[row] = vector
+            base = index_factory.new_index(target, self.dimension, training_vectors=vectors)
+            if len(live_ids):
+                base.add_with_ids(vectors, live_ids)
+        else:
+            base = faiss.clone_index(self.base)
+            if dead_in_base:
+                index_factory.remove_ids(base, np.array(sorted(dead_in_base), dtype='int64'))
+            for segment in self.deltas:
+                keep = np.array(sorted(segment.ids - dead_ids), dtype='int64')
+                if len(keep):
+                    base.add_with_ids(self.reconstruct(keep), keep)
+        self._commit((self._write_segment("base", base),))
@@ -0,0 +1,231 @@
+"""
+Shared embedding/vector search service for multi-worker deployments.
+
+Normally every API process embeds and searches in-process, so each uvicorn worker holds its
+own copy of the embedding model and of every loaded FAISS index. With VECTOR_SERVICE_ADDRESS
+set, one service process owns both and the workers talk to it over a Unix socket:
+
+    python -m app.services.vector_service          # one per machine
+    uvicorn app.main:app --workers 4               # N thin API workers
+
+Calls are pickled (method, args, kwargs) tuples over multiprocessing.connection, so both
+ends authenticate with VECTOR_SERVICE_AUTHKEY (or the key the service generated, see
+authkey_path) and the socket and key file are only accessible to the service's user.
+"""
+import os
+import queue
+import secrets
+import signal
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Dict, List, Optional
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The VectorStore methods workers may call
+EXPOSED_METHODS = {"search", "search_multi", "add_texts", "remove_document", "ping"}
+
+class VectorServiceError(Exception):
+    """Raised when the shared vector service cannot be reached."""
+    pass
+
+def authkey_path(address: str) -> str:
+    """Where the service publishes its generated authkey when VECTOR_SERVICE_AUTHKEY is empty."""
+    return f"{address}.key"
+
+class RemoteVectorStore:
+    """
+    Stands in for VectorStore in API workers. Each call borrows a connection from a small
+    pool, so concurrent requests (and ingestion threads) don't queue behind each other.
+    """
+    def __init__(self, address: str):
+        self.address = address
+        self._idle: "queue.SimpleQueue[Connection]" = queue.SimpleQueue()
+
+    def _authkey(self) -> bytes:
+        if settings.VECTOR_SERVICE_AUTHKEY:
+            return settings.VECTOR_SERVICE_AUTHKEY.encode("utf-8")
+        # Read on every connect: a restarted service generates a new key
+        with open(authkey_path(self.address), "rb") as f:
+            return f.read()
+
+    def _connect(self, wait: float = 0.0) -> Connection:
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                return Client(self.address, family="AF_UNIX", authkey=self._authkey())
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                if time.monotonic() >= deadline:
+                    raise VectorServiceError(f"Vector service at {self.address} is not reachable: {e}") from e
+                time.sleep(0.2)
+
+    def _call(self, method: str, *args, wait: float = 0.0, **kwargs):
+        try:
+            conn, pooled = self._idle.get_nowait(), True
+        except queue.Empty:
+            conn, pooled = self._connect(wait), False
+
+        try:
+            conn.send((method, args, kwargs))
+        except (OSError, EOFError):
+            conn.close()
+            if not pooled:
+                raise
+            # The service restarted since this connection was opened; nothing was sent
+            conn = self._connect(wait)
+            conn.send((method, args, kwargs))
+
+        try:
+            status, result = conn.recv()
+        except (OSError, EOFError) as e:
+            conn.close()
+            raise VectorServiceError(f"Vector service connection lost during {method}: {e}") from e
+        except Exception:
+            # e.g. a reply that can't be unpickled; the rest of it may still be in the socket
+            conn.close()
+            raise
+
+        self._idle.put(conn)
+        if status == "error":
+            raise result
+        return result
+
+    def search(self, subject_id: int, query: str, k: int = 5, filter_dict: Optional[Dict] = None) -> List[Dict]:
+        return self._call("search", subject_id, query, k=k, filter_dict=filter_dict)
+
+    def search_multi(self, subject_id: int, query: str, filters: Dict[str, Optional[Dict]], k: int = 5) -> Dict[str, List[Dict]]:
+        return self._call("search_multi", subject_id, query, filters, k=k)
+
+    def add_texts(self, subject_id: int, texts: List[str], metadatas: List[Dict]):
+        return self._call("add_texts", subject_id, texts, metadatas)
+
+    def remove_document(self, subject_id: int, doc_id: int):
+        return self._call("remove_document", subject_id, doc_id)
+
+    def ping(self, wait: float = 0.0) -> Dict:
+        return self._call("ping", wait=wait)
+
+    def warm_up(self):
+        """Waits for the service to come up; it loads the model and storage itself."""
+        info = self.ping(wait=settings.VECTOR_SERVICE_CONNECT_TIMEOUT)
+        logger.info(f"Connected to vector service at {self.address} (pid {info['pid']})")
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+def _handle(conn: Connection, store):
+    """Serves one worker connection until it closes."""
+    from app.services.embedding_service import embedding_service
+
+    try:
+        while True:
+            try:
+                method, args, kwargs = conn.recv()
+            except EOFError:
+                return
+            try:
+                if method not in EXPOSED_METHODS:
+                    raise AttributeError(f"Vector service has no method {method!r}")
+                if method == "ping":
+                    result = {
+                        "pid": os.getpid(),
+                        "embedding_model": embedding_service.ready,
+                        "embedding_metrics": embedding_service.metrics(),
+                        "subjects_loaded": len(store.indices),
+                    }
+                else:
+                    result = getattr(store, method)(*args, **kwargs)
+                reply = ("ok", result)
+            except Exception as e:
+                logger.error(f"Vector service {method} failed: {e}", exc_info=True)
+                reply = ("error", e)
+
+            try:
+                conn.send(reply)
+            except Exception:
+                # e.g. an exception that can't be pickled
+                conn.send(("error", RuntimeError(f"{type(reply[1]).__name__}: {reply[1]}")))
+    except (OSError, EOFError):
+        pass
+    finally:
+        conn.close()
+
+def _write_authkey(path: str, key: bytes):
+    if os.path.exists(path):
+        os.remove(path)
+    # O_EXCL: never write the key through a file or symlink planted at the path
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+
+def serve(address: str):
+    """Loads the model and storage, resumes interrupted ingestion, then serves workers until SIGTERM/SIGINT."""
+    from app.services.embedding_service import embedding_service
+    from app.services.ingestion import IngestionQueue
+    from app.services.vector_store import VectorStore
+
+    store = VectorStore()
+    store.warm_up()
+    embedding_service.warm_up()
+
+    if os.path.exists(address):
+        # Left behind by a previous run
+        os.remove(address)
+    key_path = None
+    if settings.VECTOR_SERVICE_AUTHKEY:
+        authkey = settings.VECTOR_SERVICE_AUTHKEY.encode("utf-8")
+    else:
+        authkey = secrets.token_hex(32).encode("ascii")
+        key_path = authkey_path(address)
+    # The socket is created with the umask's permissions, so restrict it before binding
+    # (a chmod afterwards would leave a window where other users can connect). This runs
+    # before the ingestion threads start, as the umask is process-wide.
+    old_umask = os.umask(0o177)
+    try:
+        if key_path:
+            _write_authkey(key_path, authkey)
+        listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    finally:
+        os.umask(old_umask)
+
+    # Documents interrupted by a restart are re-indexed here, once, not by every API worker
+    resumed = IngestionQueue(store)
+    resumed.resume_pending()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    logger.info(f"Vector service listening on {address}")
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                # Failed handshake (wrong authkey) or a client that went away
+                logger.warning(f"Rejected vector service connection: {e}")
+                continue
+            threading.Thread(target=_handle, args=(conn, store), name="vector-service", daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        resumed.shutdown()
+        for path in (address, key_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        logger.info("Vector service stopped")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if not settings.VECTOR_SERVICE_ADDRESS:
+        raise SystemExit("Set VECTOR_SERVICE_ADDRESS to the socket path the API workers should use")
+    serve(settings.VECTOR_SERVICE_ADDRESS)
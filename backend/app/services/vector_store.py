@@ -1,154 +1,708 @@
 import faiss
+import hashlib
+import itertools
 import pickle
 import os
+import heapq
+import threading
 import numpy as np
-from typing import List, Dict, Optional
+from collections import Counter, OrderedDict, defaultdict
+from operator import itemgetter
+from typing import List, Dict, Optional, Set, Iterable, Tuple
+from sqlmodel import Session, select, col, update, delete
 from app.config import settings
+from app.core.database import engine, create_db_and_tables
+from app.models.models import Chunk, ChunkRef, Document
 from app.services.embedding_service import embedding_service
+from app.services import index_factory
+from app.services.segments import SegmentedIndex
+from app.services.bm25 import BM25Index
+from app.services.cache import TTLCache, normalize_query
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Metadata fields kept in the inverted (facet) index, used to pre-filter searches
+FACET_FIELDS = ("unit", "part", "co", "document_type", "doc_id")
+
+# Chunk columns exposed as search-result metadata
+METADATA_FIELDS = ("text", "subject_id", "document_type", "filename", "doc_id", "unit", "part", "co")
+
+# Chunks read and embedded at a time when an IVF-PQ index is rebuilt with exact vectors
+REEMBED_BATCH = 2000
+
+def _chunk_metadata(chunk: Chunk) -> Dict:
+    return {field: getattr(chunk, field) for field in METADATA_FIELDS}
+
 class VectorStore:
+    """
+    Per-subject FAISS indices keyed by Chunk.id, stored as segment logs (see segments.py).
+    Chunk text and metadata live in the `chunk` table; memory only holds the indices,
+    the facet index and the tombstones.
+
+    Subjects are loaded on first use and kept in LRU order; once the resident vector and
+    keyword indices exceed VECTOR_CACHE_MAX_MB the least recently used subjects are dropped again.
+    """
     def __init__(self):
-        self.indices: Dict[int, faiss.IndexFlatL2] = {}
-        self.metadata: Dict[int, List[Dict]] = {} # subject_id -> List[metadata]
+        self.indices: "OrderedDict[int, SegmentedIndex]" = OrderedDict() # least recently used first
+        self.facets: Dict[int, Dict[str, Dict[object, Set[int]]]] = {} # subject_id -> field -> value -> chunk ids
+        self.live_counts: Dict[int, int] = {} # subject_id -> number of live chunks
+        self.tombstones: Dict[int, Set[int]] = {} # subject_id -> chunk ids deleted but still in the index
         self.last_modified: Dict[int, float] = {} # subject_id -> timestamp
+        self.sparse: Dict[int, BM25Index] = {} # subject_id -> keyword index, built on first hybrid search
+        # Changed (under _sparse_lock) whenever a subject's chunk texts change, so a keyword
+        # index built from an older snapshot is not installed
+        self._sparse_stamps: Dict[int, int] = {}
+        self._sparse_lock = threading.Lock()
+        # Search results are cached per subject version; any change to a subject bumps it
+        self.versions: Dict[int, int] = {}
+        self._version_counter = itertools.count(1)
+        self.retrieval_cache = TTLCache(settings.RETRIEVAL_CACHE_SIZE, settings.RETRIEVAL_CACHE_TTL)
         self.dimension = 384 # all-MiniLM-L6-v2 dimension
-        self._load_indices()
+        # Serialises writers (add/remove/compaction); searches only wait for it to migrate a legacy index
+        self._write_lock = threading.RLock()
+        self._compacting: Set[int] = set()
+        # Subjects with searches in flight (subject_id -> count); eviction leaves them loaded
+        # so a search never loses the facets or tombstones it is reading
+        self._searching: Counter = Counter()
+        self._searching_lock = threading.Lock()
+        # Storage is set up on first use rather than at import time
+        self._storage_ready = False
+        self._storage_lock = threading.Lock()
+
+    def _get_subject_dir(self, subject_id: int) -> str:
+        return os.path.join(settings.FAISS_INDEX_DIR, f"subject_{subject_id}")
 
     def _get_index_path(self, subject_id: int) -> str:
+        # Single-file index written before segment logs; only read to migrate it
         return os.path.join(settings.FAISS_INDEX_DIR, f"subject_{subject_id}.index")
 
     def _get_metadata_path(self, subject_id: int) -> str:
+        # Only used to import indices saved before chunks moved to the database
         return os.path.join(settings.FAISS_INDEX_DIR, f"subject_{subject_id}_metadata.pkl")
 
     def reload_if_stale(self, subject_id: int):
-        """Reloads the index if the file on disk is newer than our in-memory version."""
-        index_path = self._get_index_path(subject_id)
-        if not os.path.exists(index_path):
-            return
+        """Reloads the index if its manifest on disk is newer than our in-memory version."""
+        self._init_storage()
+        subject_dir = self._get_subject_dir(subject_id)
+        manifest_path = os.path.join(subject_dir, "manifest.json")
+        if not os.path.exists(manifest_path):
+            if not os.path.exists(self._get_index_path(subject_id)):
+                return
+            # One-off, so concurrent first searches may wait here; only one of them imports
+            with self._write_lock:
+                if not os.path.exists(manifest_path):
+                    self._migrate_single_file(subject_id)
 
-        current_mtime = os.path.getmtime(index_path)
+        current_mtime = os.path.getmtime(manifest_path)
         last_mtime = self.last_modified.get(subject_id, 0)
 
         if current_mtime > last_mtime:
-            logger.info(f"Detected staleness in subject {subject_id}. Reloading...")
+            logger.info(f"Loading index of subject {subject_id}")
             try:
-                self.indices[subject_id] = faiss.read_index(index_path)
-                metadata_path = self._get_metadata_path(subject_id)
-                if os.path.exists(metadata_path):
-                    with open(metadata_path, "rb") as f:
-                        self.metadata[subject_id] = pickle.load(f)
+                self.indices[subject_id] = SegmentedIndex.open(subject_dir, self.dimension, mmap_base=settings.VECTOR_MMAP_BASE)
+                self._load_chunk_state(subject_id)
                 self.last_modified[subject_id] = current_mtime
+                self._bump_version(subject_id)
+                self._evict(keep=subject_id)
             except Exception as e:
                 logger.error(f"Reload failed for subject {subject_id}: {e}")
+        self._touch(subject_id)
+
+    def _touch(self, subject_id: int):
+        try:
+            self.indices.move_to_end(subject_id)
+        except KeyError:
+            pass # not loaded, or evicted by another thread meanwhile
+
+    def _evict(self, keep: int):
+        """Drops least recently used subjects until the resident indices fit VECTOR_CACHE_MAX_MB."""
+        budget = settings.VECTOR_CACHE_MAX_MB * 1024 * 1024
+        resident = sum(self._resident_bytes(subject_id) for subject_id in list(self.indices))
+        if resident <= budget:
+            return
+        # Never make a search wait behind an upload or compaction; the next load tries again
+        if not self._write_lock.acquire(blocking=False):
+            return
+        try:
+            for subject_id in list(self.indices):
+                if resident <= budget:
+                    break
+                if subject_id == keep or subject_id in self._compacting:
+                    continue
+                with self._searching_lock:
+                    if self._searching[subject_id]:
+                        continue
+                    resident -= self._resident_bytes(subject_id)
+                    self._unload(subject_id)
+                logger.info(f"Evicted index of subject {subject_id} ({resident / 1024 / 1024:.0f} MB resident)")
+        finally:
+            self._write_lock.release()
+
+    def _resident_bytes(self, subject_id: int) -> int:
+        """Heap memory of a loaded subject: its index segments plus its keyword index."""
+        index = self.indices.get(subject_id)
+        sparse = self.sparse.get(subject_id)
+        return (index.nbytes if index is not None else 0) + (sparse.nbytes if sparse is not None else 0)
+
+    def _unload(self, subject_id: int):
+        for state in (self.indices, self.facets, self.live_counts, self.tombstones, self.last_modified):
+            state.pop(subject_id, None)
+        self._update_sparse(subject_id, drop=True)
+
+    def _migrate_single_file(self, subject_id: int):
+        """Turns a subject_<id>.index file (plus any metadata pickle) into the base segment of a segment log."""
+        index_path = self._get_index_path(subject_id)
+        logger.info(f"Migrating {index_path} to a segment log")
+        index = faiss.read_index(index_path)
+        metadata_path = self._get_metadata_path(subject_id)
+        if os.path.exists(metadata_path):
+            index = self._import_pickle(subject_id, index, metadata_path)
+        SegmentedIndex.create(self._get_subject_dir(subject_id), self.dimension, base_index=index)
+        os.remove(index_path)
+        if os.path.exists(metadata_path):
+            os.remove(metadata_path)
+
+    def _load_chunk_state(self, subject_id: int):
+        """Rebuilds the facet index and tombstones from the chunk table (no chunk text is read)."""
+        columns = [Chunk.id, Chunk.deleted] + [getattr(Chunk, field) for field in FACET_FIELDS]
+        with Session(engine) as session:
+            rows = session.exec(select(*columns).where(Chunk.subject_id == subject_id)).all()
 
-    def _load_indices(self):
-        if not os.path.exists(settings.FAISS_INDEX_DIR):
-            os.makedirs(settings.FAISS_INDEX_DIR)
+        self.facets[subject_id] = {}
+        self.tombstones[subject_id] = set()
+        # Rebuilt from the chunk table on the next hybrid search
+        self._update_sparse(subject_id, drop=True)
+        live = {}
+        for chunk_id, deleted, *values in rows:
+            if deleted:
+                self.tombstones[subject_id].add(chunk_id)
+            else:
+                live[chunk_id] = dict(zip(FACET_FIELDS, values))
+        self._index_facets(subject_id, live)
+        self.live_counts[subject_id] = len(live)
+
+    def _import_pickle(self, subject_id: int, index: faiss.Index, metadata_path: str) -> faiss.Index:
+        """
+        Moves chunks saved in a metadata pickle (a list where position = vector row) into
+        the chunk table and re-keys the index by the new Chunk ids. Vectors without
+        metadata are dropped.
+        """
+        with open(metadata_path, "rb") as f:
+            stored = pickle.load(f)
+        if index.ntotal != len(stored):
+            logger.warning(f"Subject {subject_id}: {index.ntotal} vectors but {len(stored)} metadata entries; re-upload its documents if results look wrong")
+        old_chunks = dict(enumerate(stored[:index.ntotal]))
+        logger.info(f"Importing {len(old_chunks)} chunks of subject {subject_id} into the database")
+
+        old_ids = np.array(sorted(old_chunks), dtype='int64')
+        if isinstance(index, faiss.IndexFlat):
+            # Legacy indices are a bare IndexFlatL2 whose row number is the id
+            vectors = index.reconstruct_n(0, index.ntotal)[old_ids]
+        else:
+            vectors = index_factory.reconstruct(index, old_ids)
+
+        with Session(engine) as session:
+            chunks = []
+            for old_id in old_ids:
+                meta = old_chunks[int(old_id)]
+                chunks.append(self._new_chunk(subject_id, meta, self._content_hash(meta.get("text", ""), meta)))
+            session.add_all(chunks)
+            session.flush()
+            session.add_all(ChunkRef(chunk_id=chunk.id, doc_id=chunk.doc_id) for chunk in chunks if chunk.doc_id is not None)
+            session.commit()
+            new_ids = np.array([chunk.id for chunk in chunks], dtype='int64')
+
+        imported = index_factory.new_index("flat", self.dimension)
+        if len(new_ids):
+            imported.add_with_ids(vectors, new_ids)
+        return imported
+
+    def _init_storage(self):
+        # Runs once, before the first index is touched; indices themselves are loaded by reload_if_stale()
+        if self._storage_ready:
             return
+        with self._storage_lock:
+            if self._storage_ready:
+                return
+            os.makedirs(settings.FAISS_INDEX_DIR, exist_ok=True)
+            # The chunk table must exist before any index is loaded
+            create_db_and_tables()
+            self._storage_ready = True
 
-        for filename in os.listdir(settings.FAISS_INDEX_DIR):
-            if filename.endswith(".index"):
-                try:
-                    subject_id = int(filename.split("_")[1].split(".")[0])
-                    self.reload_if_stale(subject_id)
-                except Exception as e:
-                    logger.error(f"Error loading initial index {filename}: {e}")
+    def warm_up(self):
+        """Prepares storage; subject indices still load on first use."""
+        self._init_storage()
 
-    def get_or_create_index(self, subject_id: int) -> faiss.IndexFlatL2:
+    def get_or_create_index(self, subject_id: int) -> SegmentedIndex:
         self.reload_if_stale(subject_id)
         if subject_id not in self.indices:
-            self.indices[subject_id] = faiss.IndexFlatL2(self.dimension)
-            self.metadata[subject_id] = []
-            # Initialize mtime if creating new
-            index_path = self._get_index_path(subject_id)
-            if os.path.exists(index_path):
-                self.last_modified[subject_id] = os.path.getmtime(index_path)
+            self.indices[subject_id] = SegmentedIndex.create(self._get_subject_dir(subject_id), self.dimension)
+            self.facets[subject_id] = {}
+            self.tombstones[subject_id] = set()
+            self.live_counts[subject_id] = 0
+            self._mark_saved(subject_id)
+            self._evict(keep=subject_id)
         return self.indices[subject_id]
 
+    def _mark_saved(self, subject_id: int):
+        # Our own write is not a reason to reload
+        self.last_modified[subject_id] = os.path.getmtime(self.indices[subject_id].manifest_path)
+        self._bump_version(subject_id)
+
+    def _bump_version(self, subject_id: int):
+        # Globally increasing, so a subject that is unloaded and loaded again never reuses a version
+        self.versions[subject_id] = next(self._version_counter)
+
+    @staticmethod
+    def _new_chunk(subject_id: int, meta: Dict, content_hash: Optional[str] = None) -> Chunk:
+        return Chunk(
+            text=meta.get("text", ""),
+            unit=meta.get("unit"),
+            part=meta.get("part"),
+            co=meta.get("co"),
+            document_type=meta.get("document_type", ""),
+            filename=meta.get("filename", ""),
+            subject_id=subject_id,
+            doc_id=meta.get("doc_id"),
+            content_hash=content_hash,
+        )
+
+    @staticmethod
+    def _content_hash(text: str, meta: Dict) -> str:
+        """Identity of a chunk within a subject: its text plus the tags searches filter on."""
+        key = "\x1f".join([text] + [str(meta.get(field) or "") for field in ("unit", "part", "co", "document_type")])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _existing_chunks(session: Session, subject_id: int, hashes: Set[str]) -> Dict[str, int]:
+        """content_hash -> id of the live chunks of a subject that have one of these hashes."""
+        rows = session.exec(select(Chunk.content_hash, Chunk.id).where(
+            Chunk.subject_id == subject_id, Chunk.deleted == False, col(Chunk.content_hash).in_(hashes)
+        )).all()
+        return dict(rows)
+
     def add_texts(self, subject_id: int, texts: List[str], metadatas: List[Dict]):
-        self.reload_if_stale(subject_id)
-        index = self.get_or_create_index(subject_id)
-        embeddings = embedding_service.generate_embeddings(texts)
-        if not embeddings:
+        """
+        Adds chunks to a subject. A chunk the subject already has (same content_hash) is
+        neither embedded nor stored again: the document gets a ChunkRef to the existing
+        chunk and its ref_count goes up.
+        """
+        if not texts:
             return
-            
-        embeddings_np = np.array(embeddings).astype('float32')
-        index.add(embeddings_np)
-        
-        if subject_id not in self.metadata:
-            self.metadata[subject_id] = []
-        self.metadata[subject_id].extend(metadatas)
-        
-        self.save_index(subject_id)
+        self._init_storage()
+        hashes = [self._content_hash(text, meta) for text, meta in zip(texts, metadatas)]
+        with Session(engine) as session:
+            known = self._existing_chunks(session, subject_id, set(hashes))
+
+        # Only the first occurrence of each unknown chunk is embedded (outside the lock)
+        fresh: Dict[str, int] = {} # content_hash -> position in texts, in embedding row order
+        for i, content_hash in enumerate(hashes):
+            if content_hash not in known and content_hash not in fresh:
+                fresh[content_hash] = i
+        embeddings_np = embedding_service.encode_batch([texts[i] for i in fresh.values()]) if fresh else None
+
+        with self._write_lock:
+            self.reload_if_stale(subject_id)
+            index = self.get_or_create_index(subject_id)
+
+            # Rows are committed first so their ids are final before they enter the index
+            with Session(engine) as session:
+                # Another upload may have stored some of these chunks in the meantime
+                known = self._existing_chunks(session, subject_id, set(hashes))
+                pending = [(row, content_hash, i) for row, (content_hash, i) in enumerate(fresh.items()) if content_hash not in known]
+                rows = [row for row, _, _ in pending]
+                chunks = [self._new_chunk(subject_id, metadatas[i], content_hash) for _, content_hash, i in pending]
+                session.add_all(chunks)
+                session.flush()
+
+                ids_by_hash = {**known, **{chunk.content_hash: chunk.id for chunk in chunks}}
+                refs = {(ids_by_hash[content_hash], meta["doc_id"]) for content_hash, meta in zip(hashes, metadatas) if meta.get("doc_id") is not None}
+                known_ids = set(known.values())
+                existing_refs = set(session.exec(select(ChunkRef.chunk_id, ChunkRef.doc_id).where(col(ChunkRef.chunk_id).in_(known_ids))).all()) if known_ids else set()
+                new_refs = refs - existing_refs
+                session.add_all(ChunkRef(chunk_id=chunk_id, doc_id=doc_id) for chunk_id, doc_id in new_refs)
+
+                added_refs = Counter(chunk_id for chunk_id, _ in new_refs)
+                for chunk in chunks:
+                    chunk.ref_count = max(1, added_refs.pop(chunk.id, 0))
+                for chunk_id, count in added_refs.items():
+                    session.execute(update(Chunk).where(Chunk.id == chunk_id).values(ref_count=Chunk.ref_count + count))
+                session.commit()
+
+                chunk_ids = np.array([chunk.id for chunk in chunks], dtype='int64')
+                new_chunks = {chunk.id: {field: getattr(chunk, field) for field in FACET_FIELDS} for chunk in chunks}
+                new_texts = {chunk.id: chunk.text for chunk in chunks}
+
+            if len(chunks) < len(hashes):
+                logger.info(f"Subject {subject_id}: {len(hashes) - len(chunks)} of {len(hashes)} chunks already indexed, referenced instead")
+            if not chunks:
+                return
+
+            # Only the newest delta segment is written, not the whole index
+            index.add(embeddings_np[rows], chunk_ids)
+            self._mark_saved(subject_id)
+            self._index_facets(subject_id, new_chunks)
+            self._update_sparse(subject_id, add=new_texts)
+            self.live_counts[subject_id] += len(new_chunks)
+
+            too_many_deltas = len(index.deltas) > settings.VECTOR_MAX_DELTAS
+            tier_changed = index_factory.target_kind(index.kind, self.live_counts[subject_id]) != index.kind
+            if too_many_deltas or tier_changed:
+                self.schedule_compaction(subject_id)
+
+    def _index_facets(self, subject_id: int, chunks: Dict[int, Dict]):
+        facets = self.facets.setdefault(subject_id, {})
+        for chunk_id, meta in chunks.items():
+            for field in FACET_FIELDS:
+                value = meta.get(field)
+                if value is not None:
+                    facets.setdefault(field, {}).setdefault(value, set()).add(chunk_id)
+
+    def _unindex_facets(self, subject_id: int, chunk_ids: Iterable[int]):
+        chunk_ids = set(chunk_ids)
+        for values in self.facets.get(subject_id, {}).values():
+            for value in list(values):
+                values[value] -= chunk_ids
+                if not values[value]:
+                    del values[value]
+
+    @staticmethod
+    def _value_matches(value, meta_val) -> bool:
+        """Case-insensitive substring match for strings, equality for everything else."""
+        if isinstance(value, str) and isinstance(meta_val, str):
+            return value.lower() in meta_val.lower()
+        return meta_val == value
+
+    def _filter_ids(self, subject_id: int, filter_dict: Dict) -> np.ndarray:
+        """
+        Resolves a filter to the sorted chunk ids that satisfy it.
+        Facet fields are answered from the inverted index (one check per distinct value);
+        any other chunk column falls back to a scan of that column. Deleted chunks never match.
+        """
+        facets = self.facets.get(subject_id, {})
+        matching: Optional[Set[int]] = None
+        for key, value in filter_dict.items():
+            if key in FACET_FIELDS:
+                ids = set()
+                for meta_val, value_ids in facets.get(key, {}).items():
+                    if self._value_matches(value, meta_val):
+                        ids |= value_ids
+            elif key in METADATA_FIELDS:
+                with Session(engine) as session:
+                    rows = session.exec(select(Chunk.id, getattr(Chunk, key)).where(Chunk.subject_id == subject_id, Chunk.deleted == False)).all()
+                ids = {chunk_id for chunk_id, meta_val in rows if self._value_matches(value, meta_val)}
+            else:
+                ids = set()
+            matching = ids if matching is None else matching & ids
+            if not matching:
+                break
+        return np.array(sorted(matching or ()), dtype='int64')
+
+    def _update_sparse(self, subject_id: int, add: Optional[Dict[int, str]] = None, remove: Iterable[int] = (), drop: bool = False):
+        """Applies a change of the subject's chunk texts to its keyword index (if built), or drops the index."""
+        with self._sparse_lock:
+            self._sparse_stamps[subject_id] = next(self._version_counter)
+            if drop:
+                self.sparse.pop(subject_id, None)
+                return
+            sparse = self.sparse.get(subject_id)
+        if sparse is not None:
+            # BM25Index has its own lock
+            if add:
+                sparse.add(add)
+            if remove:
+                sparse.remove(remove)
+
+    def _sparse_index(self, subject_id: int) -> BM25Index:
+        """
+        The subject's BM25 index, built from its live chunk texts on first use. The build
+        reads a snapshot without the write lock, so a search never waits behind an upload
+        or compaction; the result is only kept if no chunk changed while it was built
+        (otherwise it still serves this search, and the next one builds again).
+        """
+        sparse = self.sparse.get(subject_id)
+        if sparse is not None:
+            return sparse
+        with self._sparse_lock:
+            stamp = self._sparse_stamps.get(subject_id)
+        with Session(engine) as session:
+            rows = session.exec(select(Chunk.id, Chunk.text).where(Chunk.subject_id == subject_id, Chunk.deleted == False)).all()
+        sparse = BM25Index()
+        sparse.add(dict(rows))
+        with self._sparse_lock:
+            if self._sparse_stamps.get(subject_id) != stamp or subject_id not in self.indices:
+                logger.info(f"Subject {subject_id} changed while its keyword index was built; not keeping it")
+                return sparse
+            sparse = self.sparse.setdefault(subject_id, sparse)
+        logger.info(f"Built keyword index for subject {subject_id} ({len(sparse)} chunks, {len(sparse.postings)} terms)")
+        self._evict(keep=subject_id)
+        return sparse
+
+    @staticmethod
+    def _fuse(vector_hits: Optional[Tuple[np.ndarray, np.ndarray]], keyword_hits: List[Tuple[int, float]], k: int):
+        """
+        Reciprocal-rank fusion of a FAISS result and a BM25 result: every chunk scores
+        1 / (HYBRID_RRF_K + rank) per list it appears in. Returns the top k in index.search's shape.
+        """
+        scores: Dict[int, float] = defaultdict(float)
+        if vector_hits is not None:
+            ranked = [int(chunk_id) for chunk_id in vector_hits[1][0] if chunk_id != -1]
+            for rank, chunk_id in enumerate(ranked, start=1):
+                scores[chunk_id] += 1.0 / (settings.HYBRID_RRF_K + rank)
+        for rank, (chunk_id, _) in enumerate(keyword_hits, start=1):
+            scores[chunk_id] += 1.0 / (settings.HYBRID_RRF_K + rank)
+        top = heapq.nlargest(k, scores.items(), key=itemgetter(1))
+        return (
+            np.array([[score for _, score in top]], dtype='float32'),
+            np.array([[chunk_id for chunk_id, _ in top]], dtype='int64'),
+        )
 
     def search(self, subject_id: int, query: str, k: int = 5, filter_dict: Optional[Dict] = None) -> List[Dict]:
+        return self.search_multi(subject_id, query, {"_": filter_dict}, k=k)["_"]
+
+    def search_multi(self, subject_id: int, query: str, filters: Dict[str, Optional[Dict]], k: int = 5) -> Dict[str, List[Dict]]:
+        """
+        Runs one query against several filters at once (e.g. one per unit).
+        The query is embedded once. Each filter is turned into an ID selector through the
+        facet index, so FAISS only scores matching vectors and every pool gets the full k
+        whenever that many chunks match. Chunk rows for all pools are fetched in one query.
+
+        With HYBRID_SEARCH, each pool is the reciprocal-rank fusion of the top
+        HYBRID_CANDIDATES vector hits and BM25 keyword hits under the same filter, and
+        "score" is the fused score (higher is better) instead of the L2 distance.
+
+        Results are cached by (subject version, normalized query, filters, k), so a repeated
+        prompt skips the encoder and FAISS until the subject changes. Callers get fresh lists.
+        """
+        with self._searching_lock:
+            self._searching[subject_id] += 1
+        try:
+            return self._search_multi(subject_id, query, filters, k)
+        finally:
+            with self._searching_lock:
+                self._searching[subject_id] -= 1
+                if not self._searching[subject_id]:
+                    del self._searching[subject_id]
+
+    def _search_multi(self, subject_id: int, query: str, filters: Dict[str, Optional[Dict]], k: int) -> Dict[str, List[Dict]]:
+        pools = {key: [] for key in filters}
         self.reload_if_stale(subject_id)
         if subject_id not in self.indices:
-            return []
-            
+            return pools
+
         index = self.indices[subject_id]
         if index.ntotal == 0:
-            return []
+            return pools
+
+        cache_key = (
+            subject_id,
+            self.versions.get(subject_id),
+            normalize_query(query),
+            tuple((key, tuple(sorted(f.items())) if f else None) for key, f in filters.items()),
+            k,
+        )
+        cached = self.retrieval_cache.get(cache_key)
+        if cached is not None:
+            return {key: list(pool) for key, pool in cached.items()}
 
         query_embedding = embedding_service.generate_embedding(query)
         query_np = np.array([query_embedding]).astype('float32')
-        
-        # Search for more candidates if we are filtering
-        search_k = k * 3 if filter_dict else k
-        distances, indices = index.search(query_np, search_k)
-        
+        # Each side contributes more candidates than k when they are fused
+        pool_k = max(k, settings.HYBRID_CANDIDATES) if settings.HYBRID_SEARCH else k
+
+        hits = {} # key -> (distances, ids)
+        allowed = {} # key -> ids matching its filter (None = every live chunk)
+        unfiltered = None
+        for key, filter_dict in filters.items():
+            if not filter_dict:
+                # Unfiltered keys all share one plain search, skipping deleted chunks
+                if unfiltered is None:
+                    sel = None
+                    dead = self.tombstones.get(subject_id)
+                    if dead:
+                        dead_ids = np.array(sorted(dead), dtype='int64')
+                        sel = faiss.IDSelectorNot(faiss.IDSelectorBatch(dead_ids))
+                    unfiltered = index.search(query_np, min(pool_k, index.ntotal), sel)
+                hits[key] = unfiltered
+                allowed[key] = None
+                continue
+
+            ids = self._filter_ids(subject_id, filter_dict)
+            if ids.size == 0:
+                continue
+            allowed[key] = set(ids.tolist())
+            search_k = min(pool_k, ids.size)
+            if index.kind != "flat" and ids.size <= settings.VECTOR_EXACT_FILTER_MAX:
+                # Graph/IVF search with a tight selector can miss matches; score small sets exactly
+                hits[key] = self._exact_search(index, query_np, ids, search_k)
+            else:
+                hits[key] = index.search(query_np, search_k, faiss.IDSelectorBatch(ids))
+
+        if settings.HYBRID_SEARCH and hits:
+            sparse = self._sparse_index(subject_id)
+            for key in hits:
+                hits[key] = self._fuse(hits[key], sparse.search(query, pool_k, allowed[key]), k)
+
+        all_ids = {int(chunk_id) for _, ids in hits.values() for chunk_id in ids[0] if chunk_id != -1}
+        chunks = self._fetch_chunks(all_ids)
+        for key, (distances, ids) in hits.items():
+            pools[key] = self._to_results(chunks, distances, ids)
+
+        self.retrieval_cache.put(cache_key, {key: list(pool) for key, pool in pools.items()})
+        return pools
+
+    @staticmethod
+    def _exact_search(index: SegmentedIndex, query_np: np.ndarray, ids: np.ndarray, k: int):
+        """Brute-force L2 over just the given ids, in the same shape index.search returns."""
+        vectors = index.reconstruct(ids)
+        distances = ((vectors - query_np[0]) ** 2).sum(axis=1)
+        order = np.argsort(distances)[:k]
+        return distances[order][None, :], ids[order][None, :]
+
+    @staticmethod
+    def _fetch_chunks(chunk_ids: Iterable[int]) -> Dict[int, Dict]:
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return {}
+        with Session(engine) as session:
+            rows = session.exec(select(Chunk).where(col(Chunk.id).in_(chunk_ids), Chunk.deleted == False)).all()
+            return {chunk.id: _chunk_metadata(chunk) for chunk in rows}
+
+    @staticmethod
+    def _to_results(chunks: Dict[int, Dict], distances: np.ndarray, indices: np.ndarray) -> List[Dict]:
         results = []
-        subject_metadata = self.metadata.get(subject_id, [])
-        
-        for i, idx in enumerate(indices[0]):
-            if idx != -1 and idx < len(subject_metadata):
-                meta = subject_metadata[idx]
-                
-                # Apply filter if provided
-                if filter_dict:
-                    match = True
-                    for key, value in filter_dict.items():
-                        meta_val = meta.get(key)
-                        if isinstance(value, str) and isinstance(meta_val, str):
-                            if value.lower() not in meta_val.lower():
-                                match = False
-                                break
-                        elif meta_val != value:
-                            match = False
-                            break
-                    if not match:
-                        continue
-                
-                results.append({
-                    "text": meta.get("text", ""),
-                    "metadata": meta,
-                    "score": float(distances[0][i])
-                })
-                
-                if len(results) >= k:
-                    break
-        
+        for i, chunk_id in enumerate(indices[0]):
+            meta = chunks.get(int(chunk_id))
+            if meta is None:
+                continue
+            results.append({
+                "text": meta.get("text", ""),
+                "metadata": meta,
+                "score": float(distances[0][i])
+            })
         return results
 
     def remove_document(self, subject_id: int, doc_id: int):
-        if subject_id in self.metadata:
-            original_count = len(self.metadata[subject_id])
-            self.metadata[subject_id] = [m for m in self.metadata[subject_id] if m.get("doc_id") != doc_id]
-            new_count = len(self.metadata[subject_id])
-            
-            if original_count != new_count:
-                logger.info(f"Removed document {doc_id} from subject {subject_id} metadata ({original_count} -> {new_count} chunks)")
-                self.save_index(subject_id)
-            else:
-                logger.warning(f"No metadata found for document {doc_id} in subject {subject_id}")
+        """
+        Drops the document's references to its chunks. Chunks no other document references
+        are tombstoned; shared chunks it was named on move to a remaining document.
+        """
+        with self._write_lock:
+            self.reload_if_stale(subject_id)
+            if subject_id not in self.indices:
+                return
+
+            with Session(engine) as session:
+                referenced = list(session.exec(select(ChunkRef.chunk_id).where(ChunkRef.doc_id == doc_id)).all())
+                if not referenced:
+                    logger.warning(f"No chunks found for document {doc_id} in subject {subject_id}")
+                    return
+
+                session.execute(delete(ChunkRef).where(ChunkRef.doc_id == doc_id))
+                session.execute(update(Chunk).where(col(Chunk.id).in_(referenced)).values(ref_count=Chunk.ref_count - 1))
+                # Tombstone the orphaned chunks; compaction removes their vectors and rows later
+                removed = list(session.exec(select(Chunk.id).where(col(Chunk.id).in_(referenced), Chunk.ref_count <= 0)).all())
+                if removed:
+                    session.execute(update(Chunk).where(col(Chunk.id).in_(removed)).values(deleted=True, text=""))
+
+                moved = session.exec(
+                    select(Chunk.id, ChunkRef.doc_id, Document.filename)
+                    .join(ChunkRef, ChunkRef.chunk_id == Chunk.id)
+                    .join(Document, Document.id == ChunkRef.doc_id)
+                    .where(col(Chunk.id).in_(referenced), Chunk.doc_id == doc_id, Chunk.ref_count > 0)
+                ).all()
+                new_owners = {}
+                for chunk_id, new_doc_id, filename in moved:
+                    if chunk_id not in new_owners:
+                        new_owners[chunk_id] = new_doc_id
+                        session.execute(update(Chunk).where(Chunk.id == chunk_id).values(doc_id=new_doc_id, filename=filename))
+                session.commit()
+
+            doc_facet = self.facets.get(subject_id, {}).setdefault("doc_id", {})
+            for chunk_id, new_doc_id in new_owners.items():
+                doc_facet.get(doc_id, set()).discard(chunk_id)
+                doc_facet.setdefault(new_doc_id, set()).add(chunk_id)
+            if not doc_facet.get(doc_id, True):
+                del doc_facet[doc_id]
+            self._unindex_facets(subject_id, removed)
+            self._update_sparse(subject_id, remove=removed)
+            self.tombstones[subject_id].update(removed)
+            self.live_counts[subject_id] -= len(removed)
+            logger.info(f"Removed document {doc_id} from subject {subject_id} ({len(removed)} chunks tombstoned, {len(referenced) - len(removed)} still shared)")
+
+            index = self.indices[subject_id]
+            # New manifest generation so other processes reload the chunk state
+            index.bump()
+            self._mark_saved(subject_id)
+            too_many_dead = len(self.tombstones[subject_id]) > settings.VECTOR_COMPACTION_THRESHOLD * index.ntotal
+            tier_changed = index_factory.target_kind(index.kind, self.live_counts[subject_id]) != index.kind
+            if too_many_dead or tier_changed:
+                self.schedule_compaction(subject_id)
+
+    def schedule_compaction(self, subject_id: int):
+        """Runs compact() in a background thread unless one is already running for the subject."""
+        with self._write_lock:
+            if subject_id in self._compacting:
+                return
+            self._compacting.add(subject_id)
+        threading.Thread(target=self.compact, args=(subject_id,), name=f"compact-subject-{subject_id}", daemon=True).start()
+
+    @staticmethod
+    def _embed_chunks(chunk_ids: np.ndarray) -> Dict[int, np.ndarray]:
+        """
+        Exact vectors for chunks whose index only holds a lossy copy (IVF-PQ), embedded
+        again from their text (mostly served by the embedding cache). Chunks without text
+        are left out.
+        """
+        logger.info(f"Re-embedding {len(chunk_ids)} chunks to rebuild an IVF-PQ index with exact vectors")
+        exact = {}
+        ids = chunk_ids.tolist()
+        for start in range(0, len(ids), REEMBED_BATCH):
+            with Session(engine) as session:
+                rows = session.exec(select(Chunk.id, Chunk.text).where(col(Chunk.id).in_(ids[start:start + REEMBED_BATCH]))).all()
+            rows = [(chunk_id, text) for chunk_id, text in rows if text]
+            if rows:
+                vectors = embedding_service.encode_batch([text for _, text in rows])
+                exact.update((chunk_id, vector) for (chunk_id, _), vector in zip(rows, vectors))
+        return exact
+
+    def compact(self, subject_id: int):
+        """
+        Merges a subject's delta segments into a new base segment, dropping tombstoned
+        vectors (and then their chunk rows) and moving the subject to the index tier that fits
+        its size (see index_factory.target_kind). The new segments are committed with one
+        manifest swap; searches keep using the old segments until then.
+        """
+        try:
+            with self._write_lock:
+                index = self.indices[subject_id]
+                dead = set(self.tombstones.get(subject_id, ()))
+                current = index.kind
+                target = index_factory.target_kind(current, self.live_counts[subject_id])
+                if not dead and target == current and not index.deltas:
+                    return
+
+                with Session(engine) as session:
+                    live_ids = session.exec(select(Chunk.id).where(Chunk.subject_id == subject_id, Chunk.deleted == False)).all()
+                index.merge(dead, target, np.array(sorted(live_ids), dtype='int64'), exact_vectors=self._embed_chunks)
+                self._mark_saved(subject_id)
 
-    def save_index(self, subject_id: int):
-        if subject_id in self.indices:
-            faiss.write_index(self.indices[subject_id], self._get_index_path(subject_id))
-            with open(self._get_metadata_path(subject_id), "wb") as f:
-                pickle.dump(self.metadata[subject_id], f)
+                # Rows are purged only once the committed segments no longer refer to them
+                if dead:
+                    with Session(engine) as session:
+                        session.execute(delete(Chunk).where(col(Chunk.id).in_(list(dead))))
+                        session.commit()
+                self.tombstones[subject_id] -= dead
+                logger.info(f"Compacted subject {subject_id} ({current} -> {target}): dropped {len(dead)} dead vectors, {index.ntotal} remain")
+        except Exception as e:
+            logger.error(f"Compaction failed for subject {subject_id}: {e}")
+        finally:
+            self._compacting.discard(subject_id)
 
-vector_store = VectorStore()
+if settings.VECTOR_SERVICE_ADDRESS:
+    # Search and indexing run in the shared vector service process
+    from app.services.vector_service import RemoteVectorStore
+    vector_store = RemoteVectorStore(settings.VECTOR_SERVICE_ADDRESS)
+else:
+    vector_store = VectorStore()
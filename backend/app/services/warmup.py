@@ -0,0 +1,55 @@
+import threading
+import time
+from typing import Optional
+from app.config import settings
+from app.services.embedding_service import embedding_service
+from app.services.ingestion import ingestion_queue
+from app.services.vector_store import vector_store
+import logging
+
+logger = logging.getLogger(__name__)
+
+class WarmUp:
+    """
+    Does the slow part of startup (vector storage, embedding model, resuming interrupted
+    ingestion) on a background thread, so the API accepts requests right away.
+    /health/ready reports ready once it has finished.
+    """
+    def __init__(self):
+        self.state = "pending" # pending -> running -> done | failed
+        self.error: Optional[str] = None
+        self.seconds: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state == "done"
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="warm-up", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        self.state = "running"
+        started = time.perf_counter()
+        try:
+            vector_store.warm_up()
+            # With a shared vector service there are several API workers; the service
+            # resumes interrupted ingestion once instead of every worker racing to
+            if not settings.VECTOR_SERVICE_ADDRESS:
+                ingestion_queue.resume_pending()
+            # With a shared vector service the model lives there, not in this process
+            if settings.EMBEDDING_WARM_UP and not settings.VECTOR_SERVICE_ADDRESS:
+                embedding_service.warm_up()
+        except Exception as e:
+            logger.error(f"Warm-up failed: {e}", exc_info=True)
+            self.error = str(e)
+            self.state = "failed"
+            return
+        self.seconds = time.perf_counter() - started
+        self.state = "done"
+        logger.info(f"Warm-up finished in {self.seconds:.1f}s")
+
+warm_up = WarmUp()
@@ -0,0 +1,73 @@
+"""
+Golden-corpus check and micro-benchmark for the chat query parser.
+
+    python bench_query_parser.py [iterations]
+
+Every query in GOLDEN must parse to exactly the expected plan (fields not listed are
+expected to be empty/False); the script exits non-zero otherwise. It then times
+parse_query, split_text and clean_q_text per call.
+"""
+import itertools
+import sys
+import time
+from dataclasses import asdict
+from app.services.query_parser import QueryPlan, parse_query
+from app.services.pdf_service import PDFService
+from app.services.pdf_generator import clean_q_text
+
+# (query, expected non-default QueryPlan fields, expected filter_dict())
+GOLDEN = [
+    ("Generate 5 two-mark questions from Unit 1", {"units": ["unit 1"], "creative": True}, {"unit": "unit 1"}),
+    ("Give me Part B questions from unit 3", {"units": ["unit 3"], "part": "b"}, {"unit": "unit 3", "part": "part b"}),
+    ("units 1, 2 and 3 important questions", {"units": ["unit 1", "unit 2", "unit 3"]}, {"unit": "unit 1"}),
+    ("Module IV 16 marks questions", {"units": ["unit iv"], "marks": "16"}, {"unit": "unit iv", "part": "part b"}),
+    ("questions for CO-2", {"co": "co2"}, {"co": "co2"}),
+    ("Section c questions unit:5", {"units": ["unit 5"], "part": "c"}, {"unit": "unit 5", "part": "part c"}),
+    ("mixed questions from all units", {"global_multi": True}, {}),
+    ("2 marks questions", {"marks": "2"}, {"part": "part a"}),
+    ("16 mark questions on thermodynamics", {"marks": "16"}, {"part": "part b"}),
+    ("What is entropy?", {"deterministic": True}, {}),
+    ("Explain the toughest questions in unit 2", {"units": ["unit 2"], "deterministic": True}, {"unit": "unit 2"}),
+    ("design a question paper across units", {"global_multi": True, "creative": True}, {}),
+    ("unit 2 & 4 part a", {"units": ["unit 2", "unit 4"], "part": "a"}, {"unit": "unit 2", "part": "part a"}),
+    ("Chapter 3 co1 part b 16 marks", {"units": ["unit 3"], "part": "b", "co": "co1", "marks": "16"}, {"unit": "unit 3", "part": "part b", "co": "co1"}),
+    # Keywords are substring matches: "topics" contains "top"
+    ("list the topics", {"deterministic": True}, {}),
+    ("random questions", {"global_multi": True}, {}),
+    ("make 10 questions from unit ii and iii", {"units": ["unit ii", "unit iii"], "creative": True}, {"unit": "unit ii"}),
+    ("hello", {}, {}),
+    ("Units 1,1,2 questions", {"units": ["unit 1", "unit 2"]}, {"unit": "unit 1"}),
+    ("part d questions from unit 6", {"units": ["unit 6"]}, {"unit": "unit 6"}),
+]
+
+SAMPLE_PAGE = "\n".join(
+    f"UNIT {u}\nPART A\n" + "\n".join(f"{q}. Define term {q} of unit {u} (CO{u})" for q in range(1, 11))
+    for u in range(1, 6)
+)
+
+def check_golden() -> int:
+    failures = 0
+    for query, fields, filters in GOLDEN:
+        expected = asdict(QueryPlan(**fields))
+        plan = parse_query(query)
+        if asdict(plan) != expected or plan.filter_dict() != filters:
+            failures += 1
+            print(f"FAIL {query!r}\n  expected {expected} {filters}\n  got      {asdict(plan)} {plan.filter_dict()}")
+    print(f"golden corpus: {len(GOLDEN) - failures}/{len(GOLDEN)} ok")
+    return failures
+
+def bench(name: str, fn, iterations: int):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<14} {elapsed / iterations * 1e6:9.1f} us/call")
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    if check_golden():
+        sys.exit(1)
+    next_query = itertools.cycle([query for query, _, _ in GOLDEN]).__next__
+    bench("parse_query", lambda: parse_query(next_query()), iterations)
+    bench("split_text", lambda: PDFService.split_text(SAMPLE_PAGE), max(iterations // 100, 1))
+    bench("clean_q_text", lambda: clean_q_text("1. Unit 2: Define entropy (Un CO2) [Unit 2] (2 marks)"), iterations)
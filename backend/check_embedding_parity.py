@@ -0,0 +1,40 @@
+import sqlite3
+import sys
+from app.config import settings
+from app.services.embedding_service import embedding_service
+
+# Compares the configured EMBEDDING_BACKEND (plus EMBEDDING_NORMALIZE / EMBEDDING_FP16) with the
+# plain float32 PyTorch model, on chunk texts from the database.
+# Usage: python check_embedding_parity.py [sample_size] [min_cosine]
+
+SAMPLE_TEXTS = [
+    "Explain the working of a two-pass assembler with a neat diagram.",
+    "Define deadlock. List the necessary conditions for a deadlock to occur.",
+    "What is normalization? Explain 1NF, 2NF and 3NF with examples.",
+    "Compare TCP and UDP.",
+    "UNIT 3 PART A",
+]
+
+def load_texts(limit: int):
+    try:
+        conn = sqlite3.connect("database.db")
+        rows = conn.execute("SELECT text FROM chunk WHERE deleted = 0 ORDER BY RANDOM() LIMIT ?", (limit,)).fetchall()
+        conn.close()
+        return [row[0] for row in rows] or SAMPLE_TEXTS
+    except sqlite3.Error:
+        return SAMPLE_TEXTS
+
+if __name__ == "__main__":
+    sample_size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    min_cosine = float(sys.argv[2]) if len(sys.argv) > 2 else 0.99
+
+    texts = load_texts(sample_size)
+    print(f"Backend: {settings.EMBEDDING_BACKEND} (normalize={settings.EMBEDDING_NORMALIZE}, fp16={settings.EMBEDDING_FP16})")
+    report = embedding_service.parity_check(texts)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+    if report["min_cosine"] < min_cosine:
+        print(f"FAIL: min cosine {report['min_cosine']:.4f} < {min_cosine}; reindex if you switch to this backend")
+        sys.exit(1)
+    print("OK")
@@ -1,10 +1,14 @@
 import React, { useState, useRef, useEffect } from 'react';
 import { Send, User, Bot, Loader2, Sparkles, FileDown } from 'lucide-react';
 import ReactMarkdown from 'react-markdown';
-import { chat, getChatHistory, generateExamPDF } from '../services/api';
+import { chatStream, getChatHistory, generateExamPDF } from '../services/api';
+
+const HISTORY_PAGE_SIZE = 50;
 
 const ChatWindow = ({ subject }) => {
     const [messages, setMessages] = useState([]);
+    const [hasEarlier, setHasEarlier] = useState(false);
+    const [loadingEarlier, setLoadingEarlier] = useState(false);
     const [input, setInput] = useState('');
     const [loading, setLoading] = useState(false);
     const [isPolling, setIsPolling] = useState(false);
@@ -61,11 +65,13 @@ const ChatWindow = ({ subject }) => {
     const fetchHistory = async () => {
         setLoadingHistory(true);
         try {
-            const history = await getChatHistory(subject.id);
+            const history = await getChatHistory(subject.id, { limit: HISTORY_PAGE_SIZE });
             const formatted = history.map(msg => ({
                 role: msg.role,
-                content: msg.content
+                content: msg.content,
+                created_at: msg.created_at
             }));
+            setHasEarlier(history.length === HISTORY_PAGE_SIZE);
 
             if (formatted.length === 0) {
                 setMessages([{
@@ -82,8 +88,26 @@ const ChatWindow = ({ subject }) => {
         }
     };
 
+    const loadEarlier = async () => {
+        const oldest = messages.find(msg => msg.created_at);
+        if (!oldest) return;
+        setLoadingEarlier(true);
+        try {
+            const page = await getChatHistory(subject.id, { before: oldest.created_at, limit: HISTORY_PAGE_SIZE });
+            setHasEarlier(page.length === HISTORY_PAGE_SIZE);
+            setMessages(prev => [
+                ...page.map(msg => ({ role: msg.role, content: msg.content, created_at: msg.created_at })),
+                ...prev
+            ]);
+        } catch (error) {
+            console.error("Failed to load earlier messages", error);
+        } finally {
+            setLoadingEarlier(false);
+        }
+    };
+
     // Robust Polling: Keeps checking history if the server is slow
-    const pollForResponse = async (lastMessageCount, retryCount = 0) => {
+    const pollForResponse = async (userMessage, retryCount = 0) => {
         if (retryCount > 15) { // Stop after 30 seconds
             setIsPolling(false);
             setMessages(prev => [...prev, {
@@ -94,17 +118,17 @@ const ChatWindow = ({ subject }) => {
         }
 
         try {
-            const history = await getChatHistory(subject.id);
-            const formattedHistory = history.map(msg => ({ role: msg.role, content: msg.content }));
+            // Only the latest exchange matters: our question followed by an answer
+            const [question, answer] = await getChatHistory(subject.id, { limit: 2 });
 
-            if (formattedHistory.length > lastMessageCount && formattedHistory[formattedHistory.length - 1].role === 'assistant') {
+            if (question?.role === 'user' && question.content === userMessage && answer?.role === 'assistant') {
                 // Success! New message found
-                setMessages(formattedHistory);
                 setIsPolling(false);
+                fetchHistory();
             } else {
                 // Not ready yet, poll again in 2s
                 pollingTimeoutRef.current = setTimeout(() => {
-                    pollForResponse(lastMessageCount, retryCount + 1);
+                    pollForResponse(userMessage, retryCount + 1);
                 }, 2000);
             }
         } catch (error) {
@@ -118,25 +142,39 @@ const ChatWindow = ({ subject }) => {
         if (!input.trim() || loading || isPolling) return;
 
         const userMessage = input;
-        const currentMessageCount = messages.length;
 
         setInput('');
         setMessages(prev => [...prev, { role: 'user', content: userMessage }]);
         setLoading(true);
 
         try {
-            const response = await chat(subject.id, userMessage);
-            setMessages(prev => [...prev, {
-                role: 'assistant',
-                content: response.answer,
-                context: response.context_used
-            }]);
+            let started = false;
+            const response = await chatStream(subject.id, userMessage, (token) => {
+                if (!started) {
+                    started = true;
+                    setLoading(false);
+                    setMessages(prev => [...prev, { role: 'assistant', content: token }]);
+                    return;
+                }
+                setMessages(prev => {
+                    const last = prev[prev.length - 1];
+                    return [...prev.slice(0, -1), { ...last, content: last.content + token }];
+                });
+            });
+            setMessages(prev => {
+                const base = started ? prev.slice(0, -1) : prev;
+                return [...base, {
+                    role: 'assistant',
+                    content: response.answer,
+                    context: response.context_used
+                }];
+            });
         } catch (error) {
             console.error("Chat error:", error);
             // Don't show "error" immediately, start polling instead
             setLoading(false);
             setIsPolling(true);
-            pollForResponse(currentMessageCount + 1); // +1 for the user message we just added
+            pollForResponse(userMessage);
         } finally {
             setLoading(false);
         }
@@ -172,6 +210,11 @@ const ChatWindow = ({ subject }) => {
                     </div>
                 ) : (
                     <>
+                        {hasEarlier && (
+                            <button onClick={loadEarlier} className="refresh-btn" disabled={loadingEarlier} style={{ alignSelf: 'center', marginBottom: '1rem' }}>
+                                {loadingEarlier ? <Loader2 size={16} className="animate-spin" /> : "Load earlier messages"}
+                            </button>
+                        )}
                         {messages.map((msg, idx) => (
                             <div key={idx} className={`message-wrapper animate-slide-up ${msg.role === 'user' ? 'user' : 'bot'}`}>
                                 <div className={`message-bubble ${msg.role === 'user' ? 'user' : 'bot'}`}>
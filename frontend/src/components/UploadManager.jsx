@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { Upload, FileText, CheckCircle, AlertCircle, Loader2, RefreshCw, X } from 'lucide-react';
-import { uploadFile, getSubjectDocuments, deleteDocument } from '../services/api';
+import { uploadFile, getSubjectDocuments, deleteDocument, getDocumentStatus } from '../services/api';
 import DocumentTable from './DocumentTable';
 
 const UploadManager = ({ subject }) => {
@@ -98,11 +98,29 @@ const UploadManager = ({ subject }) => {
 
         setStatus('uploading');
         try {
-            await uploadFile(formData);
+            const upload = await uploadFile(formData);
+            fetchDocuments(); // Show the queued document right away
+
+            // Wait for the background indexing job to finish
+            let job = upload;
+            while (job.status !== 'indexed' && job.status !== 'failed') {
+                const pages = job.page_count ? ` (${job.pages_done}/${job.page_count} pages)` : '';
+                setMessage(`${file.name}: ${job.status}${pages}...`);
+                await new Promise((resolve) => setTimeout(resolve, 2000));
+                job = await getDocumentStatus(upload.document_id);
+            }
+            fetchDocuments(); // Refresh list
+            if (job.status === 'failed') {
+                setStatus('error');
+                setMessage(job.error || `Failed to index ${file.name}.`);
+                return;
+            }
+
             setStatus('success');
-            setMessage(`${file.name} uploaded successfully.`);
+            setMessage(upload.duplicate
+                ? `${file.name} was already uploaded as ${upload.filename}.`
+                : `${file.name} uploaded successfully.`);
             setFile(null);
-            fetchDocuments(); // Refresh list
 
             // Clear success message after 3 seconds
             setTimeout(() => {
@@ -195,6 +213,18 @@ const UploadManager = ({ subject }) => {
                                 <CheckCircle size={14} /> {message}
                             </div>
                         )}
+
+                        {status === 'uploading' && message && (
+                            <div style={{ color: 'var(--text-secondary)', fontSize: '0.875rem' }}>
+                                {message}
+                            </div>
+                        )}
+
+                        {status === 'error' && (
+                            <div style={{ color: 'var(--error)', display: 'flex', gap: '0.5rem', alignItems: 'center', fontSize: '0.875rem' }}>
+                                <AlertCircle size={14} /> {message}
+                            </div>
+                        )}
                     </div>
 
                     {/* Document List Section */}
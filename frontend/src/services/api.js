@@ -34,6 +34,12 @@ export const uploadFile = async (formData) => {
     return response.data;
 };
 
+// Indexing runs in the background; poll this until status is 'indexed' or 'failed'
+export const getDocumentStatus = async (documentId) => {
+    const response = await api.get(`/upload/${documentId}/status`);
+    return response.data;
+};
+
 export const deleteDocument = async (documentId) => {
     const response = await api.delete(`/upload/${documentId}`);
     return response.data;
@@ -47,8 +53,51 @@ export const chat = async (subjectId, message) => {
     return response.data;
 };
 
-export const getChatHistory = async (subjectId) => {
-    const response = await api.get(`/chat/${subjectId}/history`);
+// Streams the answer from POST /chat/stream (NDJSON), calling onToken for every piece.
+// Resolves with the final { answer, context_used, message_id } once the stream ends.
+export const chatStream = async (subjectId, message, onToken) => {
+    const response = await fetch(`${API_URL}/chat/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ subject_id: subjectId, message }),
+    });
+    if (!response.ok || !response.body) {
+        throw new Error(`Chat stream failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = { answer: '', context_used: [], message_id: null };
+
+    const handleLine = (line) => {
+        if (!line.trim()) return;
+        const event = JSON.parse(line);
+        if (event.type === 'context') {
+            result.context_used = event.context_used;
+        } else if (event.type === 'token') {
+            result.answer += event.content;
+            onToken(event.content);
+        } else if (event.type === 'done') {
+            result = { ...result, answer: event.answer, message_id: event.message_id };
+        }
+    };
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.forEach(handleLine);
+    }
+    handleLine(buffer);
+    return result;
+};
+
+// Newest `limit` messages (oldest first); pass the created_at of the oldest one as `before` for the previous page.
+export const getChatHistory = async (subjectId, { before, limit } = {}) => {
+    const response = await api.get(`/chat/${subjectId}/history`, { params: { before, limit } });
     return response.data;
 };
 